@@ -2,8 +2,11 @@ from paste.urlmap import parse_path_expression, URLMap
 
 from service.app import Service
 from service.conf_reader import ConfReader
+from service.executor import Executor
 from service.gunicorn import GunicornApp
 from service.logger.logging import setup_logging
+from service.model.db.db_parser import DBLoader
+from service.model.index import TopologyIndex
 
 
 def urlmap_factory(loader, global_conf, **local_conf):
@@ -25,11 +28,15 @@ class URLMapGunicornHook(URLMap):
     """
     def start(self):
         """ A hook to when a Gunicorn worker calls run()."""
-        pass
+        # Each worker must open its own DB connections instead of the ones inherited from the master
+        DBLoader().dispose()
+        if TopologyIndex().enabled:
+            TopologyIndex().start()
 
     def stop(self, signal):
         """ A hook to when a Gunicorn worker starts shutting down. """
-        pass
+        TopologyIndex().stop()
+        Executor().shutdown()
 
 
 #  *****Paste Factories*****
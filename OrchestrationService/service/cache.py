@@ -0,0 +1,272 @@
+import fcntl
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class CacheEntry(object):
+    """
+    Value kept in the cache, with the validator used to check it against its source and the time it was stored.
+    """
+
+    def __init__(self, value, validator=None):
+        self.value = value
+        self.validator = validator
+        self.created = time.monotonic()
+
+    def age(self):
+        """
+        :return: Seconds since the entry was stored or last revalidated
+        """
+        return time.monotonic() - self.created
+
+
+class TTLCache(object):
+    """
+    Thread safe cache where each entry lives at most ttl seconds.
+    It is bounded to max_size entries, evicting the least recently used one.
+    Each entry can keep a validator (e.g. a DB watermark or an HTTP ETag) so the owner can check if the cached
+    value still matches its source without reading it again.
+    """
+
+    def __init__(self, ttl, max_size=128):
+        """
+        :param ttl: Seconds an entry is considered fresh. A ttl of 0 disables the cache.
+        :param max_size: Maximum number of entries kept
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+    def get(self, key, validator=None):
+        """
+        Get a fresh value from the cache.
+        :param key: The key of the entry
+        :param validator: When provided the entry is only valid if it was stored with the same validator
+        :return: The cached value or None when missing, expired or invalid
+        """
+        entry = self.get_entry(key)
+        if entry is None or entry.age() >= self.ttl:
+            return None
+        if validator is not None and entry.validator != validator:
+            return None
+        return entry.value
+
+    def get_entry(self, key):
+        """
+        Get an entry even if expired, allowing it to be revalidated against its source.
+        :param key: The key of the entry
+        :return: CacheEntry or None when missing
+        """
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is not None:
+                self.__entries.move_to_end(key)
+            return entry
+
+    def set(self, key, value, validator=None):
+        """
+        Store a value, evicting the least recently used entries when full.
+        :param key: The key of the entry
+        :param value: The value to store
+        :param validator: The validator of the value
+        """
+        if not self.enabled:
+            return
+        with self.__lock:
+            self.__entries[key] = CacheEntry(value, validator)
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.max_size:
+                self.__entries.popitem(last=False)
+
+    def touch(self, key):
+        """
+        Renew an entry after it was revalidated against its source.
+        :param key: The key of the entry
+        """
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is not None:
+                entry.created = time.monotonic()
+
+    def invalidate(self, key=None):
+        """
+        Remove an entry or, when no key is provided, all the entries.
+        :param key: The key of the entry
+        """
+        with self.__lock:
+            if key is None:
+                self.__entries.clear()
+            else:
+                self.__entries.pop(key, None)
+
+
+class SharedFileCache(object):
+    """
+    Cache of bytes values shared by all the workers of a host, each entry kept on a file of a directory, e.g. on
+    /dev/shm so the files stay in memory. An entry is written by the first worker that finds it stale, while the rest
+    wait on its lock and then read what it wrote, so the value is only built and kept once per host.
+    Each file starts with the length of its header, followed by the JSON header with the generation, validator and
+    creation time of the entry, and the value. The files are replaced atomically, so a reader keeps the entry it
+    opened even if it's replaced meanwhile, and can reply it straight from the file, e.g. with sendfile.
+    """
+
+    HEADER_LENGTH = 8  # Digits of the header length at the start of each file
+
+    def __init__(self, directory, ttl):
+        """
+        :param directory: Directory of the entry files, created if missing and only accessible by the worker user.
+        None disables the cache, as a directory owned by another user does.
+        :param ttl: Seconds an entry is considered fresh. A ttl of 0 disables the cache.
+        """
+        self.directory = directory
+        self.ttl = ttl
+        if self.enabled:
+            os.makedirs(self.directory, mode=0o700, exist_ok=True)
+            if os.stat(self.directory).st_uid != os.getuid():
+                logger.error('The shared cache directory {} is owned by another user, the cache is disabled'.format(
+                    self.directory))
+                self.directory = None
+
+    @property
+    def enabled(self):
+        return self.directory is not None and self.ttl > 0
+
+    def open(self, key, validator=None):
+        """
+        Open a fresh entry.
+        :param key: The key of the entry
+        :param validator: When provided the entry is only valid if it was stored with the same validator
+        :return: Tuple with the unbuffered file, positioned at the value, and the value length. None when missing,
+        expired or invalid.
+        """
+        if not self.enabled:
+            return None
+        try:
+            entry = open(self.__path__(key), 'rb', buffering=0)
+        except FileNotFoundError:
+            return None
+        try:
+            header = json.loads(entry.read(int(entry.read(SharedFileCache.HEADER_LENGTH))).decode('utf-8'))
+            if time.time() - header.get('created') >= self.ttl or \
+                    validator is not None and header.get('validator') != validator:
+                entry.close()
+                return None
+            return entry, os.fstat(entry.fileno()).st_size - entry.tell()
+        except Exception as e:
+            logger.warning('Failed to read the shared cache entry {}: {}'.format(key, e))
+            entry.close()
+            return None
+
+    def get(self, key, validator=None):
+        """
+        Read a fresh value from the cache.
+        :param key: The key of the entry
+        :param validator: When provided the entry is only valid if it was stored with the same validator
+        :return: The cached bytes or None when missing, expired or invalid
+        """
+        entry = self.open(key, validator=validator)
+        if entry is None:
+            return None
+        with entry[0] as value:
+            return value.read()
+
+    def generation(self, key):
+        """
+        :param key: The key of the entry
+        :return: The number of times the entry was written, 0 when missing
+        """
+        try:
+            with open(self.__path__(key), 'rb') as entry:
+                return json.loads(entry.read(int(entry.read(SharedFileCache.HEADER_LENGTH))).decode('utf-8')).get(
+                    'generation')
+        except Exception:
+            return 0
+
+    @contextmanager
+    def lock(self, key):
+        """
+        Exclusive lock of an entry among all the workers of the host, held while the entry is refreshed.
+        The lock is released by the OS if the worker holding it dies.
+        :param key: The key of the entry
+        """
+        with open(self.__path__(key) + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def set(self, key, value, validator=None):
+        """
+        Store a value, replacing the entry atomically. Should be called while holding the entry lock.
+        :param key: The key of the entry
+        :param value: The bytes to store
+        :param validator: The validator of the value, must be JSON serializable
+        :return: The generation of the entry, 0 when the cache is disabled
+        """
+        if not self.enabled:
+            return 0
+        generation = self.generation(key) + 1
+        header = json.dumps(dict(generation=generation, validator=validator, created=time.time())).encode('utf-8')
+        fd, path = tempfile.mkstemp(dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as entry:
+                entry.write('{:0{}d}'.format(len(header), SharedFileCache.HEADER_LENGTH).encode('ascii'))
+                entry.write(header)
+                entry.write(value)
+            os.replace(path, self.__path__(key))
+        except Exception:
+            if os.path.exists(path):
+                os.remove(path)
+            raise
+        return generation
+
+    def evict(self, max_size):
+        """
+        Remove the expired entries and, when there are more than max_size, the least recently written ones.
+        The entries are told apart by their modification time, so the headers are not read.
+        :param max_size: Maximum number of entries kept
+        """
+        if not self.enabled:
+            return
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if not name.endswith('.lock') and os.path.isfile(path) and not name.startswith('tmp'):
+                    entries.append((os.path.getmtime(path), path))
+            except FileNotFoundError:
+                continue
+
+        entries.sort(reverse=True)
+        now = time.time()
+        for idx, (modified, path) in enumerate(entries):
+            if idx >= max_size or now - modified >= self.ttl:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def __path__(self, key):
+        """
+        :param key: The key of the entry
+        :return: The path of the entry file
+        :raise ValueError: When the key resolves to a path outside the cache directory
+        """
+        path = os.path.realpath(os.path.join(self.directory, key))
+        if os.path.dirname(path) != os.path.realpath(self.directory):
+            raise ValueError('The shared cache key {} is outside the cache directory'.format(key))
+        return path
@@ -0,0 +1,59 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from service.conf_reader import ConfReader
+from service.utils import Singleton
+
+
+class Executor(metaclass=Singleton):
+    """
+    Bounded thread pool of each worker, used to wait on independent inventory and topology requests concurrently.
+    The pool is created on the first use, so each Gunicorn worker has its own threads.
+    Tasks that fan out again run their inner tasks on their own thread, since waiting on the pool from one of its
+    threads could exhaust it.
+    """
+
+    def __init__(self):
+        self.workers = ConfReader().get('REQUESTER', 'workers')
+        self.__pool = None
+        self.__lock = threading.Lock()
+        self.__local = threading.local()
+
+    @property
+    def pool(self):
+        with self.__lock:
+            if self.__pool is None:
+                self.__pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='Executor')
+            return self.__pool
+
+    def map(self, function, *iterables):
+        """
+        Calls the function with the arguments of each iterable concurrently, like the builtin map.
+        The calls run on the current thread when there's only one, the pool has a single thread or the current thread
+        already belongs to the pool.
+        :param function: The function to call
+        :param iterables: The iterables with the arguments of each call
+        :return: List with the results, in the order of the arguments. The first exception raised is propagated.
+        """
+        arguments = list(zip(*iterables))
+        if len(arguments) <= 1 or self.workers <= 1 or getattr(self.__local, 'task', False):
+            return [function(*args) for args in arguments]
+
+        futures = [self.pool.submit(self.__run__, function, *args) for args in arguments]
+        return [future.result() for future in futures]
+
+    def __run__(self, function, *args):
+        self.__local.task = True
+        try:
+            return function(*args)
+        finally:
+            self.__local.task = False
+
+    def shutdown(self):
+        """
+        Stops the pool threads. A hook to when a worker starts shutting down.
+        """
+        with self.__lock:
+            if self.__pool is not None:
+                self.__pool.shutdown(wait=False)
+                self.__pool = None
@@ -1,4 +1,5 @@
 from gunicorn.app.base import Application
+from gunicorn.workers.gthread import ThreadWorker
 from gunicorn.workers.sync import SyncWorker
 
 
@@ -15,6 +16,19 @@ class CustomWorker(SyncWorker):
         super().run()
 
 
+class CustomThreadWorker(ThreadWorker):
+    """
+    Custom ThreadWorker to be used when more than one thread per worker is configured
+    """
+    def handle_quit(self, sig, frame):
+        self.app.application.stop(sig)
+        super().handle_quit(sig, frame)
+
+    def run(self):
+        self.app.application.start()
+        super().run()
+
+
 class GunicornApp(Application):
     """ Custom Gunicorn application
     This allows for us to load gunicorn settings from an external source
@@ -40,7 +54,10 @@ class GunicornApp(Application):
         for key, value in self.options.items():
             self.cfg.set(key.lower(), value)
 
-        self.cfg.set('worker_class', 'service.gunicorn.CustomWorker')
+        if self.cfg.threads > 1:
+            self.cfg.set('worker_class', 'service.gunicorn.CustomThreadWorker')
+        else:
+            self.cfg.set('worker_class', 'service.gunicorn.CustomWorker')
 
     def load(self):
         return self.application
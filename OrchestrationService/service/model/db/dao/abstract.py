@@ -1,4 +1,9 @@
+import hashlib
+import json
 import logging
+from collections import OrderedDict
+
+from sqlalchemy import func, select
 
 from service.error import handle_topology_exception
 from service.conf_reader import ConfReader
@@ -12,6 +17,11 @@ class ABSDao(object):
 
     logger = logging.getLogger(__name__)
     DATABASE_NAME = ConfReader().get_section_dict('TOPOLOGY_DATABASE')  # The DB name equals across all tables.
+    REPORTED_TIME = 'reportedTime'  # Column updated by the collectors whenever a row is reported
+    IN_CHUNK_SIZE = 500  # Maximum number of keys sent in a single IN clause
+    STREAM_BATCH = 1000  # Number of rows fetched at a time from the DB cursor when streaming
+    STATE = 'state'  # Column with the message type, on the tables that have it
+    LABELS = None  # API name of each column, see __labels__
 
     @staticmethod
     def __clean_dict__(obj):
@@ -22,25 +32,127 @@ class ABSDao(object):
         """
         return {k: v for k, v in obj.items() if v is not None}
 
+    @classmethod
+    def __labels__(cls):
+        """
+        API name of each column of the DAO table, i.e., its DB_MAP key. The columns that aren't on DB_MAP keep their
+        name and come first, in the table order, followed by the DB_MAP columns in the DB_MAP order.
+        :return: Ordered dict with the column name as key and the API name as value
+        """
+        labels = cls.__dict__.get('LABELS')
+        if labels is None:
+            columns = cls.TABLE.columns.keys()
+            mapped = set(cls.DB_MAP.values())
+            labels = OrderedDict((column, column) for column in columns if column not in mapped)
+            labels.update((value, key) for key, value in cls.DB_MAP.items() if value in columns)
+            cls.LABELS = labels
+        return labels
+
+    @classmethod
+    def __labelled_columns__(cls, *filter_by):
+        """
+        Columns of the DAO table labelled with their API names, so the rows are queried already keyed by them.
+        :param filter_by: The column names to select, all columns when none is provided
+        :return: List with the labelled columns, in the __labels__ order
+        """
+        return [getattr(cls.TABLE.c, column).label(label) for column, label in cls.__labels__().items()
+                if len(filter_by) == 0 or column in filter_by]
+
+    @classmethod
+    def __label_row__(cls, row, *filter_by):
+        """
+        Copies a row keyed by the column names, e.g., kept in memory, keyed by the API names as the
+        __labelled_columns__ queries reply them.
+        :param row: Dict with the row
+        :param filter_by: The column names to keep, all columns when none is provided
+        :return: Dict with the row keyed by the API names
+        """
+        return {label: row[column] for column, label in cls.__labels__().items()
+                if column in row and (len(filter_by) == 0 or column in filter_by)}
+
+    @classmethod
+    def __message_columns__(cls):
+        """
+        Columns read to create the messages: the DB_MAP columns labelled with their DB_MAP key, followed by the state
+        when the table has one.
+        :return: List with the labelled columns
+        """
+        columns = [getattr(cls.TABLE.c, value).label(key) for key, value in cls.DB_MAP.items()]
+        if ABSDao.STATE in cls.TABLE.columns.keys():
+            columns.append(getattr(cls.TABLE.c, ABSDao.STATE).label(ABSDao.STATE))
+        return columns
+
     @classmethod
     def __create_message__(cls, row):
         """
         Creates a message like the real time, with the same structure.
-        It also creates the message's inner object.
-        :param row: The DB row to transform in real time message.
+        It also creates the message's inner object, in a single pass over the row.
+        :param row: Row of the __message_columns__ query
         :return: Real time message in dict format
         """
         message = dict()
         message['eventtype'] = cls.EVENT_TYPE
-        message['type'] = row.pop('state', None)
-        inner_obj = dict()
-        for key, value in cls.DB_MAP.items():
-            inner_obj[key] = row.pop(value)
-
-        message[cls.INNER_OBJ] = cls.__clean_dict__(inner_obj)
-        message = cls.__clean_dict__(message)
+        # The state is the last column, the one left by zip
+        if len(row) > len(cls.DB_MAP) and row[-1] is not None:
+            message['type'] = row[-1]
+        message[cls.INNER_OBJ] = {key: value for key, value in zip(cls.DB_MAP.keys(), row) if value is not None}
         return message
 
+    @classmethod
+    def __create_tombstone__(cls, key):
+        """
+        Creates a real time like message for a row that no longer exists.
+        :param key: The value of the KEY field of the removed row
+        :return: Real time message in dict format
+        """
+        return {'eventtype': cls.EVENT_TYPE, 'type': 'DELETE', cls.INNER_OBJ: {cls.KEY: key}}
+
+    @classmethod
+    def __get_key__(cls, message):
+        """
+        :param message: Real time message created by the DAO
+        :return: The value of the field that identifies the message inner object
+        """
+        return message.get(cls.INNER_OBJ).get(cls.KEY)
+
+    @classmethod
+    def __version__(cls, message):
+        """
+        Value that changes whenever the message content changes.
+        :param message: Real time message created by the DAO
+        :return: Digest of the message content
+        """
+        return cls.__digest__(message)
+
+    @staticmethod
+    def __digest__(value):
+        """
+        Digest of a value that equals across processes, unlike the builtin hash of strings, so the versions can be
+        compared by any worker.
+        :param value: JSON serializable value
+        :return: SHA-1 hex digest of the value
+        """
+        return hashlib.sha1(json.dumps(value, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    @classmethod
+    def __tracks_changes__(cls):
+        """
+        :return: Whether any change of the DAO rows moves its watermark, i.e., the rows have a reported time.
+        """
+        return cls.REPORTED_TIME in cls.TABLE.columns.keys()
+
+    @classmethod
+    def __watermark__(cls):
+        """
+        Aggregates that change whenever the rows read by the DAO change, without reading the rows:
+        the number of rows and, when available, the last reported time.
+        :return: List of scalar selects
+        """
+        watermark = [select([func.count()]).select_from(cls.TABLE).as_scalar()]
+        if cls.REPORTED_TIME in cls.TABLE.columns.keys():
+            watermark.append(select([func.max(getattr(cls.TABLE.c, cls.REPORTED_TIME))]).as_scalar())
+        return watermark
+
     def __init__(self, session):
         """
         Creates an instance of ABSDao
@@ -56,28 +168,86 @@ class ABSDao(object):
         :return: dict with queried type messages
         """
         # Query the database
-        rows = self.query_all()
-        self.rows = list()
-        for row in rows:
-            self.rows.append(dict(zip(type(self).TABLE.columns.keys(), row)))
-        # Create the messages
-        return [type(self).__create_message__(row) for row in self.rows]
+        return self.__create_messages__(self.query_all(columns=type(self).__message_columns__()))
+
+    def stream(self):
+        """
+        Current topology by the time of the request, as a generator.
+        The rows are read from a server side cursor, so only STREAM_BATCH rows are kept in memory.
+        :return: Generator of the queried type messages
+        """
+        query = self.session.query(*type(self).__message_columns__())
+        for row in query.yield_per(ABSDao.STREAM_BATCH):
+            yield type(self).__create_message__(row)
+
+    def __create_messages__(self, rows):
+        """
+        Creates the messages of a group of rows queried from the DAO table.
+        :param rows: Query result of the __message_columns__
+        :return: List with the messages
+        """
+        return [type(self).__create_message__(row) for row in rows]
+
+    @classmethod
+    def versions(cls, messages):
+        """
+        Version of each message, used to find the messages changed in a later snapshot.
+        :param messages: Real time messages created by the DAO
+        :return: Ordered dict with the message key as key and its version as value
+        """
+        return OrderedDict((cls.__get_key__(message), cls.__version__(message)) for message in messages)
+
+    def changes(self, watermark, versions):
+        """
+        Messages created or changed since a previous snapshot.
+        Since there's no generic way to know which rows changed, all rows are read and compared with their version.
+        :param watermark: The DAO watermark by the time of the previous snapshot
+        :param versions: The versions of the previous snapshot messages
+        :return: Tuple with the list of created or changed messages and the current versions
+        """
+        messages = self.snapshot()
+        current = self.versions(messages)
+        changed = [message for message in messages
+                   if versions.get(type(self).__get_key__(message)) != current.get(type(self).__get_key__(message))]
+        return changed, current
 
     @handle_topology_exception
-    def query_all(self):
+    def query_all(self, columns=()):
         """
         Query all rows from a table.
+        :param columns: The columns to select, by default the table
         :return: Query result as dict object
         """
-        return self.session.query(type(self).TABLE).all()
+        return self.session.query(*columns or [type(self).TABLE]).all()
 
     @handle_topology_exception
-    def query_by_filer(self, column_name, value):
+    def query_by_filer(self, column_name, value, columns=()):
         """
         Query a table by a specific filter. This method only filters by a single value in a single column.
         :param column_name: The name of the column to search for
         :param value: The value to search for
+        :param columns: The columns to select, by default the table
         :return: All query result as dict object
         """
         column = getattr(type(self).TABLE.c, column_name)
-        return self.session.query(type(self).TABLE).filter(column == value).all()
+        return self.session.query(*columns or [type(self).TABLE]).filter(column == value).all()
+
+    @handle_topology_exception
+    def query_by_keys(self, column_name, keys, table=None, columns=()):
+        """
+        Query the rows of a table where the column matches one of the keys.
+        The keys are sent in IN clauses split in chunks of IN_CHUNK_SIZE.
+        :param column_name: The name of the column to search for
+        :param keys: Iterable with the values to search for
+        :param table: The table to query, by default the DAO table
+        :param columns: The columns to select, by default the table
+        :return: All query result as dict object
+        """
+        table = type(self).TABLE if table is None else table
+        column = getattr(table.c, column_name)
+        keys = list(keys)
+        rows = []
+        for idx in range(0, len(keys), ABSDao.IN_CHUNK_SIZE):
+            query = self.session.query(*columns or [table])
+            rows.extend(query.filter(column.in_(keys[idx:idx + ABSDao.IN_CHUNK_SIZE])).all())
+        return rows
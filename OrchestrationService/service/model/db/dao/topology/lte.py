@@ -1,16 +1,17 @@
 from service.model.db.dao.abstract import ABSDao
-from service.model.db.db_parser import DBLoader
+from service.model.db.db_parser import MappedTable
 
 
 class UEDAO(ABSDao):
     """
     UE DAO abstraction to create LTE messages.
     """
-    TABLE = TABLE = DBLoader().get_table(ABSDao.DATABASE_NAME.get('ue'))
-    CLASS = DBLoader().get_base_class(ABSDao.DATABASE_NAME.get('ue'))
+    TABLE = MappedTable('ue')
+    CLASS = MappedTable('ue', mapped_class=True)
 
     EVENT_TYPE = 'ue_event'
     INNER_OBJ = 'ue'
+    KEY = 'imsi'
     DB_MAP = dict(imsi='IMSI', mcc='MCC', mnc='MNC', ueid='UEId', mme_teid_s11='mmeTeidS11', sgw_teid_s11='sgwTeidS11',
                   eps_bearer_id='epsBearerId', mme_ip='MMEIp', sgw_teid_s1='sgwTeidS1', enb_teid_s1u='enbTeidS1u',
                   sgw_ip_s1u='sgwIPS1U', enb_ip_s1u='enbIPS1U', ue_ip='UEIP')
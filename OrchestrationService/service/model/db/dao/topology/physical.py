@@ -1,14 +1,15 @@
 from service.model.db.dao.abstract import ABSDao
-from service.model.db.db_parser import DBLoader
+from service.model.db.db_parser import MappedTable
 
 
 class PhysicalDAO(ABSDao):
     """
     Physical DAO abstraction to create physical machine messages.
     """
-    TABLE = DBLoader().get_table(ABSDao.DATABASE_NAME.get('physical_machine'))
-    CLASS = DBLoader().get_base_class(ABSDao.DATABASE_NAME.get('physical_machine'))
+    TABLE = MappedTable('physical_machine')
+    CLASS = MappedTable('physical_machine', mapped_class=True)
 
     EVENT_TYPE = 'compute_event'
     INNER_OBJ = 'compute_node'
+    KEY = 'hostname'
     DB_MAP = dict(hostname='hostname', location='location', ip='ip', network_id='networkId')
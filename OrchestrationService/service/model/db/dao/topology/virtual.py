@@ -1,5 +1,10 @@
+from collections import OrderedDict
+
+from sqlalchemy import func
+
+from service.error import handle_topology_exception
 from service.model.db.dao.abstract import ABSDao
-from service.model.db.db_parser import DBLoader
+from service.model.db.db_parser import DBLoader, MappedTable
 
 
 class VirtualMachineDAO(ABSDao):
@@ -7,16 +12,25 @@ class VirtualMachineDAO(ABSDao):
     Virtual DAO abstraction to create physical machine messages.
     This class also creates the messages based on each network.
     """
-    TABLE = DBLoader().get_table(ABSDao.DATABASE_NAME.get('virtual_machine'))
-    CLASS = DBLoader().get_base_class(ABSDao.DATABASE_NAME.get('virtual_machine'))
+    TABLE = MappedTable('virtual_machine')
+    CLASS = MappedTable('virtual_machine', mapped_class=True)
 
     EVENT_TYPE = 'instance_event'
     FOREIGN_KEY = 'uuid'
     INNER_OBJ = 'vm'
+    KEY = FOREIGN_KEY
     DB_MAP = dict(location='location', name='name', tenant_id='tenantId', user_id='userId', hostname='hostName',
                   host_ip='hostIp', instance_id='instanceId', uuid='uuid', image_id='imageId',
                   reported_time='reportedTime', resource_id='resourceId', )
 
+    @classmethod
+    def __watermark__(cls):
+        """
+        Override the parent method since the VM messages also change with their networks.
+        :return: List of scalar selects
+        """
+        return super(VirtualMachineDAO, cls).__watermark__() + VMNetworkDAO.__watermark__()
+
     def snapshot(self):
         """
         Override the parent method since it needs to support the inclusion of networks. However paren'ts method is used
@@ -24,40 +38,149 @@ class VirtualMachineDAO(ABSDao):
         :return: dict with queried type messages
         """
         snapshot = super(VirtualMachineDAO, self).snapshot()
+        networks = VMNetworkDAO(self.session).snapshot_by_vm()  # All networks in a single query
+        return VirtualMachineDAO.__append_networks__(snapshot, networks)
+
+    def stream(self):
+        """
+        Override the parent method to append the networks to each batch of VMs.
+        The networks are read by another session, since the DAO session is still reading the VMs, bound to the same
+        DB, so a replica doesn't read the networks of another replica VMs.
+        :return: Generator of the queried type messages
+        """
+        session = DBLoader().session_factory(bind=self.session.get_bind())
+        try:
+            networks = VMNetworkDAO(session)
+            batch = []
+            for message in super(VirtualMachineDAO, self).stream():
+                batch.append(message)
+                if len(batch) == ABSDao.IN_CHUNK_SIZE:
+                    yield from self.__append_batch_networks__(batch, networks)
+                    batch = []
+            yield from self.__append_batch_networks__(batch, networks)
+        finally:
+            session.close()
+
+    @staticmethod
+    def __append_batch_networks__(batch, networks):
+        """
+        Append to a batch of VM messages their networks, queried at once.
+        :param batch: List with VM messages
+        :param networks: VMNetworkDAO used to query the networks
+        :return: The VM messages
+        """
+        if len(batch) == 0:
+            return batch
+        uuids = [message.get(VirtualMachineDAO.INNER_OBJ).get(VirtualMachineDAO.FOREIGN_KEY) for message in batch]
+        return VirtualMachineDAO.__append_networks__(batch, networks.snapshot_by_vm(uuids))
+
+    @classmethod
+    def __version__(cls, message):
+        """
+        Override the parent method since the rows reported time already tracks the VM changes.
+        The number of networks is also kept, since it changes when a network is removed.
+        :param message: Real time message created by the DAO
+        :return: Digest of the VM reported time, number of networks and last network reported time
+        """
+        vm = message.get(VirtualMachineDAO.INNER_OBJ)
+        reported = [n.get('network_reported_time') for n in vm.get('network', [])
+                    if n.get('network_reported_time') is not None]
+        return cls.__digest__((vm.get('reported_time'), len(vm.get('network', [])),
+                               max(reported) if reported else None))
+
+    @staticmethod
+    def __append_networks__(snapshot, networks):
+        """
+        Append to each VM message its networks.
+        :param snapshot: List with VM messages
+        :param networks: Dict with the VM foreign key as key and the list of network messages as value
+        :return: The VM messages
+        """
         for entry in snapshot:
             vm = entry.get(VirtualMachineDAO.INNER_OBJ)
-            vm['network'] = VMNetworkDAO(self.session, vm.get(VirtualMachineDAO.FOREIGN_KEY)).snapshot()
+            vm['network'] = networks.get(vm.get(VirtualMachineDAO.FOREIGN_KEY), [])
         return snapshot
 
+    def changes(self, watermark, versions):
+        """
+        Override the parent method to compare the versions queried from the reported time columns, and only read
+        the VMs and networks whose version changed, instead of reading every VM and network.
+        :param watermark: The DAO watermark by the time of the previous snapshot
+        :param versions: The versions of the previous snapshot messages
+        :return: Tuple with the list of created or changed messages and the current versions
+        """
+        foreign_key = VirtualMachineDAO.DB_MAP.get(VirtualMachineDAO.FOREIGN_KEY)
+
+        current = self.query_versions()
+        uuids = [uuid for uuid, version in current.items() if versions.get(uuid) != version]
+
+        changed = self.__create_messages__(
+            self.query_by_keys(foreign_key, uuids, columns=VirtualMachineDAO.__message_columns__()))
+        networks = VMNetworkDAO(self.session).snapshot_by_vm(uuids)
+        return VirtualMachineDAO.__append_networks__(changed, networks), current
+
+    @handle_topology_exception
+    def query_versions(self):
+        """
+        Query the current version of every VM without reading the whole rows, only the reported time of each VM and
+        the number of networks and last network reported time of each VM.
+        :return: Ordered dict with the VM foreign key as key and the version as value
+        """
+        foreign_key = VirtualMachineDAO.DB_MAP.get(VirtualMachineDAO.FOREIGN_KEY)
+        vm_table, network_table = VirtualMachineDAO.TABLE, VMNetworkDAO.TABLE
+
+        networks = dict()
+        query = self.session.query(
+            getattr(network_table.c, foreign_key),
+            func.count(),
+            func.max(getattr(network_table.c, ABSDao.REPORTED_TIME))
+        )
+        for uuid, count, reported in query.group_by(getattr(network_table.c, foreign_key)).all():
+            networks[uuid] = (count, reported)
+
+        versions = OrderedDict()
+        query = self.session.query(getattr(vm_table.c, foreign_key), getattr(vm_table.c, ABSDao.REPORTED_TIME))
+        for uuid, reported in query.all():
+            versions[uuid] = ABSDao.__digest__((reported,) + networks.get(uuid, (0, None)))
+        return versions
+
 
 class VMNetworkDAO(ABSDao):
     """
     VM Network DAO abstraction to create each VM network.
     """
-    TABLE = DBLoader().get_table(ABSDao.DATABASE_NAME.get('vm_network'))
-    CLASS = DBLoader().get_base_class(ABSDao.DATABASE_NAME.get('vm_network'))
+    TABLE = MappedTable('vm_network')
+    CLASS = MappedTable('vm_network', mapped_class=True)
 
     DB_MAP = dict(mac='mac', iface='iface', dhcp='dhcp', gateway='gateway', dns='dns', ip='vmIp',
                   network_id='networkId', port_id='portId', ovs_id='ovsId', segmentation_id='segmentationId',
                   network_reported_time='reportedTime', network_resource_id='resourceId')
 
+    @classmethod
+    def __message_columns__(cls):
+        """
+        Override the parent method, since the networks have no state. The DB_MAP columns missing on the table are left
+        out, as their fields are not replied.
+        :return: List with the labelled columns
+        """
+        columns = cls.TABLE.columns.keys()
+        return [getattr(cls.TABLE.c, value).label(key) for key, value in cls.DB_MAP.items() if value in columns]
+
     @staticmethod
-    def __create_message__(row):
+    def __create_message__(row, fields):
         """
         Override create message method, since no state, inner object or event type are needed FOR NOW.
-        :param row:
+        :param row: Row starting with the __message_columns__
+        :param fields: The labels of the __message_columns__
         :return:
         """
-        network = dict()
-        for key, value in VMNetworkDAO.DB_MAP.items():
-            network[key] = row.pop(value, None)
-        return VMNetworkDAO.__clean_dict__(network)
+        return {key: value for key, value in zip(fields, row) if value is not None}
 
-    def __init__(self, session, vm):
+    def __init__(self, session, vm=None):
         """
         Overrides ABS init because each Network needs to be related to a VM.
         :param session: The DB connection to use in the queries.
-        :param vm: The VM the networks will relate to
+        :param vm: The VM the networks will relate to. Only required by snapshot.
         """
         super().__init__(session)
         self.vm = vm
@@ -68,8 +191,26 @@ class VMNetworkDAO(ABSDao):
         to create the bases of the snapshot.
         :return: dict with queried type messages
         """
-        rows = self.query_by_filer(VirtualMachineDAO.DB_MAP.get(VirtualMachineDAO.DB_MAP.get(VirtualMachineDAO.FOREIGN_KEY)), self.vm)
-        self.rows = list()
+        foreign_key = VirtualMachineDAO.DB_MAP.get(VirtualMachineDAO.FOREIGN_KEY)
+        columns = VMNetworkDAO.__message_columns__()
+        fields = [column.key for column in columns]
+        rows = self.query_by_filer(foreign_key, self.vm, columns=columns)
+        return [VMNetworkDAO.__create_message__(row, fields) for row in rows]
+
+    def snapshot_by_vm(self, vms=None):
+        """
+        Snapshot of the networks of every VM, loaded with a single query over the whole table.
+        The networks are indexed by the VM they relate to, avoiding one query per VM.
+        :param vms: When provided only the networks of these VMs are loaded
+        :return: dict with the VM foreign key as key and the list of network messages as value
+        """
+        foreign_key = VirtualMachineDAO.DB_MAP.get(VirtualMachineDAO.FOREIGN_KEY)
+        columns = VMNetworkDAO.__message_columns__()
+        fields = [column.key for column in columns]
+        # The foreign key is selected last, so it's left out of the messages
+        columns.append(getattr(VMNetworkDAO.TABLE.c, foreign_key))
+        rows = self.query_all(columns=columns) if vms is None else self.query_by_keys(foreign_key, vms, columns=columns)
+        networks = dict()
         for row in rows:
-            self.rows.append(dict(zip(VMNetworkDAO.TABLE.columns.keys(), row)))
-        return [VMNetworkDAO.__create_message__(row) for row in self.rows]
+            networks.setdefault(row[-1], []).append(VMNetworkDAO.__create_message__(row, fields))
+        return networks
@@ -1,49 +1,232 @@
+import itertools
 import logging
+import os
+import pickle
+import tempfile
+import threading
+import time
 
-from sqlalchemy import create_engine
+from sqlalchemy import MetaData, create_engine, event, literal, select
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.exc import TimeoutError
 from sqlalchemy.ext.automap import automap_base
-from sqlalchemy.orm import sessionmaker, scoped_session, Session
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 
 from service.conf_reader import ConfReader
 from service.utils import Singleton
 from service.error import handle_topology_exception
 
 
+class MonitoredQueuePool(QueuePool):
+    """
+    Queue pool that measures how long each checkout waits for a connection.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(MonitoredQueuePool, self).__init__(*args, **kwargs)
+        self.statistics = PoolStatistics()
+
+    def _do_get(self):
+        start = time.monotonic()
+        try:
+            return super(MonitoredQueuePool, self)._do_get()
+        except TimeoutError:
+            self.statistics.increment('timeouts')
+            raise
+        finally:
+            self.statistics.wait(time.monotonic() - start)
+
+    def recreate(self):
+        pool = super(MonitoredQueuePool, self).recreate()
+        pool.statistics = self.statistics
+        return pool
+
+
+class PoolStatistics(object):
+    """
+    Counters of a connection pool usage, updated by the pool events.
+    """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.counters = dict(connects=0, checkouts=0, checkins=0, invalidations=0, timeouts=0)
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def increment(self, counter):
+        with self.__lock:
+            self.counters[counter] += 1
+
+    def wait(self, seconds):
+        with self.__lock:
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+
+    def as_dict(self):
+        with self.__lock:
+            statistics = dict(self.counters)
+            statistics['wait_total'] = self.wait_total
+            statistics['wait_max'] = self.wait_max
+            statistics['wait_average'] = self.wait_total / self.counters['checkouts'] \
+                if self.counters['checkouts'] > 0 else 0.0
+        return statistics
+
+
 class DBLoader(metaclass=Singleton):
     """
     Class responsible to load the DB and map it's tables.
-    This classes uses SQLAlchemy automap features to map all DB tables.
+    This classes uses SQLAlchemy automap features to map the topology tables.
     It can provide all the tables and creates the sessions to read from them.
+    The tables are only reflected on their first use, and can be loaded from an on-disk metadata cache so the workers
+    start without introspecting the DB.
     """
 
     logger = logging.getLogger(__name__)
+    TABLE_KEYS = ['physical_machine', 'virtual_machine', 'vm_network', 'ue']  # Tables on the Database section
 
     def __init__(self):
+        self.__lock = threading.Lock()
+        self.__metadata = None
+        self.__base = None
         self.__load_db__()
 
     @handle_topology_exception
     def __load_db__(self):
         """
-        Function to set the DB connection and tables.
-        This uses the sqlalchemy automap to populate the needed tables.
-        It is intended to keep maximum abstraction from DB to lower schema changes impact.
-        NOTE: This not create models it only refers tables
+        Function to set the DB connection.
+        The tables are loaded lazily by __load_metadata__.
         :raise EnvironmentError: Whenever the ini file doesn't contain the url on the Database section
         """
         connection = ConfReader().get('TOPOLOGY_DATABASE', 'url')
 
         if not connection:
             raise EnvironmentError('Missing Database URL connection')
-        self.engine = create_engine(connection, pool_recycle=1800, connect_args={'connect_timeout': 15})
 
-        # Create model based on DB
-        # http://docs.sqlalchemy.org/en/latest/orm/extensions/automap.html
-        self.base = automap_base()
-        self.base.prepare(self.engine, reflect=True)
+        conf = ConfReader().get_section_dict('TOPOLOGY_DATABASE')
+        self.engine = self.__create_engine__(connection, conf)
+        self.session_factory = sessionmaker(bind=self.engine)
+
+        # Read-only sessions are routed to the replicas, if any, falling back to the primary
+        self.replicas = ReplicaRouter(
+            [Replica(self.__create_engine__(url, conf), conf.get('replica_check_interval', 30))
+             for url in conf.get('replicas', None) or []],
+            conf.get('replica_routing', ReplicaRouter.ROUND_ROBIN)
+        )
+
+        self.table_names = [conf.get(key) for key in DBLoader.TABLE_KEYS if conf.get(key)]
+        self.metadata_cache = conf.get('metadata_cache', None)
+
+    @property
+    def tables(self):
+        """
+        :return: Dict with the topology tables, by name
+        """
+        return self.__load_metadata__().tables
+
+    @property
+    def base(self):
+        """
+        Automap base of the topology tables.
+        http://docs.sqlalchemy.org/en/latest/orm/extensions/automap.html
+        :return: Automap base
+        """
+        if self.__base is None:
+            metadata = self.__load_metadata__()
+            with self.__lock:
+                if self.__base is None:
+                    base = automap_base(metadata=metadata)
+                    base.prepare()
+                    self.__base = base
+        return self.__base
+
+    @handle_topology_exception
+    def __load_metadata__(self):
+        """
+        Reflects the tables named on the Database section, on the first call.
+        It is intended to keep maximum abstraction from DB to lower schema changes impact.
+        NOTE: This not create models it only refers tables
+        :return: SQLAlchemy metadata with the topology tables
+        """
+        if self.__metadata is not None:
+            return self.__metadata
+
+        with self.__lock:
+            if self.__metadata is None:
+                metadata = self.__read_metadata_cache__()
+                if metadata is None:
+                    metadata = MetaData()
+                    metadata.reflect(self.engine, only=self.table_names)
+                    self.__write_metadata_cache__(metadata)
+                self.__metadata = metadata
+        return self.__metadata
+
+    def __metadata_cache_key__(self):
+        """
+        :return: Identifies the DB and tables of a metadata cache, the password is not included.
+        """
+        return repr(self.engine.url), sorted(self.table_names)
+
+    def __read_metadata_cache__(self):
+        """
+        Loads the metadata from the cache file, if configured and written for the same DB and tables.
+        :return: SQLAlchemy metadata or None
+        """
+        if not self.metadata_cache or not os.path.isfile(self.metadata_cache):
+            return None
+        try:
+            with open(self.metadata_cache, 'rb') as cache:
+                key, metadata = pickle.load(cache)
+        except Exception as e:
+            DBLoader.logger.warning('Failed to read the metadata cache {}: {}'.format(self.metadata_cache, e))
+            return None
+        if key != self.__metadata_cache_key__():
+            return None
+        return metadata
+
+    def __write_metadata_cache__(self, metadata):
+        """
+        Saves the metadata on the cache file, if configured.
+        The file is replaced atomically, since several workers may write it at the same time.
+        :param metadata: SQLAlchemy metadata
+        """
+        if not self.metadata_cache:
+            return
+        try:
+            fd, path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.metadata_cache)))
+            with os.fdopen(fd, 'wb') as cache:
+                pickle.dump((self.__metadata_cache_key__(), metadata), cache)
+            os.replace(path, self.metadata_cache)
+        except Exception as e:
+            DBLoader.logger.warning('Failed to write the metadata cache {}: {}'.format(self.metadata_cache, e))
+
+    @staticmethod
+    def __create_engine__(connection, conf):
+        """
+        Creates an engine with the worker pool configured on the Database section.
+        :param connection: The DB URL
+        :param conf: Dict with the Database section
+        :return: SQLAlchemy engine
+        """
+        # SQLite (used as a local stand-in of the topology DB) doesn't support a connection timeout
+        if make_url(connection).get_backend_name() == 'sqlite':
+            connect_args = {'check_same_thread': False}
+        else:
+            connect_args = {'connect_timeout': 15}
 
-        # Load tables
-        # Keep maximum abstraction to lower the impact of schema changes
-        self.tables = self.base.metadata.tables
+        # A single pool per worker and DB, configured on the ini file
+        engine = create_engine(
+            connection,
+            poolclass=MonitoredQueuePool,
+            pool_size=conf.get('pool_size', 5),
+            max_overflow=conf.get('max_overflow', 10),
+            pool_timeout=conf.get('pool_timeout', 30),
+            pool_recycle=conf.get('pool_recycle', 1800),
+            pool_pre_ping=conf.get('pool_pre_ping', False),
+            connect_args=connect_args
+        )
+        DBLoader.__monitor_pool__(engine)
+        return engine
 
     def get_mapped_tables(self):
         """
@@ -69,10 +252,212 @@ class DBLoader(metaclass=Singleton):
         except Exception as e:
             return None
 
-    def create_session(self):
+    def read_bind(self, preferred=None):
+        """
+        Chooses the DB a read-only operation reads from. The sessions of an operation made of several queries, e.g.,
+        a watermark and the sections it validates, must share it, since each replica may lag differently.
+        :param preferred: The URL, see bind_url, of the DB read by an earlier operation that this one is compared
+        with, e.g., the previous poll of the topology changes. That replica is read again while it's healthy,
+        otherwise the primary is read, since no replica is ahead of it while another replica may be behind.
+        :return: The engine of a healthy replica, or the primary engine when none is healthy
+        """
+        if preferred is not None:
+            for replica in self.replicas.replicas:
+                if DBLoader.bind_url(replica.engine) == preferred and replica.available():
+                    return replica.engine
+            return self.engine
+        replica = self.replicas.choose()
+        return replica.engine if replica is not None else self.engine
+
+    @staticmethod
+    def bind_url(bind):
+        """
+        :param bind: An engine chosen with read_bind
+        :return: The URL of the engine, without the password, equal on every worker
+        """
+        return repr(bind.url)
+
+    def create_session(self, read_only=False, bind=None):
+        """
+        Crates a new DB session, from the worker session factory.
+        The session borrows a connection from the worker pool until it is closed.
+        :param read_only: Whether the session only reads, so it can be served by a healthy replica
+        :param bind: The engine chosen with read_bind for the operation, instead of choosing one for the session
+        :return: Session object
+        """
+        if bind is not None:
+            return self.session_factory(bind=bind)
+        if read_only:
+            replica = self.replicas.choose()
+            if replica is not None:
+                return self.session_factory(bind=replica.engine)
+        return self.session_factory()
+
+    def dispose(self):
+        """
+        Closes all pooled connections, e.g., the ones inherited from the master process when a worker starts.
+        """
+        self.engine.dispose()
+        for replica in self.replicas.replicas:
+            replica.engine.dispose()
+
+    def pool_statistics(self):
+        """
+        Current state and usage counters of the worker connection pools.
+        :return: Dict with the primary pool statistics, and the statistics of each replica under replicas
+        """
+        statistics = DBLoader.__engine_statistics__(self.engine)
+        statistics['replicas'] = []
+        for replica in self.replicas.replicas:
+            replica_statistics = DBLoader.__engine_statistics__(replica.engine)
+            replica_statistics['url'] = repr(replica.engine.url)
+            replica_statistics['healthy'] = replica.healthy
+            statistics['replicas'].append(replica_statistics)
+        return statistics
+
+    @staticmethod
+    def __engine_statistics__(engine):
+        pool = engine.pool
+        statistics = pool.statistics.as_dict()
+        statistics['size'] = pool.size()
+        statistics['checked_in'] = pool.checkedin()
+        statistics['checked_out'] = pool.checkedout()
+        statistics['overflow'] = pool.overflow()
+        return statistics
+
+    @staticmethod
+    def __monitor_pool__(engine):
+        """
+        Count the pool events on the pool statistics.
+        """
+        statistics = engine.pool.statistics
+        for name, counter in [('connect', 'connects'), ('checkout', 'checkouts'), ('checkin', 'checkins'),
+                              ('invalidate', 'invalidations')]:
+            event.listen(engine, name, lambda *args, counter=counter: statistics.increment(counter))
+
+
+class Replica(object):
+    """
+    Read replica of the topology DB, with its health.
+    A replica is left out of the routing whenever a health check or a connection to it fails, until the next check
+    succeeds. The checks run at most every check_interval seconds, on the request that finds the last one too old.
+    """
+
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, engine, check_interval):
+        """
+        :param engine: The replica engine
+        :param check_interval: Seconds between health checks
+        """
+        self.engine = engine
+        self.check_interval = check_interval
+        self.healthy = True
+        self.checked = None  # Time of the last check, it is checked on its first use
+        self.__lock = threading.Lock()
+        event.listen(engine, 'handle_error', self.__handle_error__)
+
+    def available(self):
+        """
+        :return: Whether the replica can serve reads, checking its health when the last check is too old
+        """
+        if self.checked is None or time.monotonic() - self.checked >= self.check_interval:
+            # A single thread checks, the others use the last result meanwhile
+            if self.__lock.acquire(blocking=False):
+                try:
+                    self.healthy = self.__check__()
+                    self.checked = time.monotonic()
+                finally:
+                    self.__lock.release()
+        return self.healthy
+
+    def load(self):
+        """
+        :return: Number of connections of the worker checked out from the replica pool
+        """
+        return self.engine.pool.checkedout()
+
+    def failed(self):
+        """
+        Leaves the replica out of the routing until the next health check.
+        """
+        self.healthy = False
+        self.checked = time.monotonic()
+
+    def __check__(self):
+        try:
+            with self.engine.connect() as connection:
+                connection.scalar(select([literal(1)]))
+            return True
+        except Exception as e:
+            Replica.logger.warning('Replica {} failed the health check: {}'.format(repr(self.engine.url), e))
+            return False
+
+    def __handle_error__(self, context):
+        if context.is_disconnect:
+            Replica.logger.warning('Replica {} lost the connection: {}'.format(repr(self.engine.url),
+                                                                                 context.original_exception))
+            self.failed()
+
+
+class ReplicaRouter(object):
+    """
+    Chooses the replica of each read-only session, among the healthy ones.
+    The round robin routing takes turns, while the least loaded routing chooses the replica with less connections
+    checked out by the worker.
+    """
+
+    ROUND_ROBIN = 'round_robin'
+    LEAST_LOADED = 'least_loaded'
+
+    def __init__(self, replicas, routing=ROUND_ROBIN):
+        """
+        :param replicas: List of Replica
+        :param routing: ROUND_ROBIN or LEAST_LOADED
+        :raise ValueError: When the routing is unknown
+        """
+        if routing not in (ReplicaRouter.ROUND_ROBIN, ReplicaRouter.LEAST_LOADED):
+            raise ValueError('Unknown replica routing {}'.format(routing))
+        self.replicas = replicas
+        self.routing = routing
+        self.__turn = itertools.count()
+
+    def choose(self):
+        """
+        :return: The Replica to read from, or None when there's no healthy replica and the primary must be used
+        """
+        available = [replica for replica in self.replicas if replica.available()]
+        if len(available) == 0:
+            return None
+        if self.routing == ReplicaRouter.LEAST_LOADED:
+            return min(available, key=lambda replica: replica.load())
+        return available[next(self.__turn) % len(available)]
+
+
+class MappedTable(object):
+    """
+    DAO attribute with a table of the Database section, resolved on its first access so importing the DAOs doesn't
+    connect to the DB.
+    """
+
+    def __init__(self, key, mapped_class=False):
         """
-        Crates a new DB session
-        :return: Scoped session object
+        :param key: The table key on the Database section
+        :param mapped_class: Whether to resolve the automap class instead of the table
         """
-        session_factory = sessionmaker(bind=self.engine)
-        return scoped_session(session_factory)
+        self.key = key
+        self.mapped_class = mapped_class
+        self.attribute = None
+
+    def __set_name__(self, owner, name):
+        self.attribute = name
+
+    def __get__(self, instance, owner):
+        name = ConfReader().get('TOPOLOGY_DATABASE', self.key)
+        if self.mapped_class:
+            value = DBLoader().get_base_class(name)
+        else:
+            value = DBLoader().get_table(name)
+        # Replace the descriptor, so the next accesses don't go through it
+        setattr(owner, self.attribute, value)
+        return value
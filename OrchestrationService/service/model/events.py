@@ -0,0 +1,198 @@
+import json
+import logging
+import queue
+import threading
+import time
+
+from service.conf_reader import ConfReader
+from service.model.topology import Topology
+from service.utils import Singleton
+
+logger = logging.getLogger(__name__)
+
+
+class Subscriber(object):
+    """
+    Client of the topology events. It holds a bounded queue of events, and if the client can't keep up with them
+    the subscriber is marked as lost, so the client can be told to reload the topology.
+    """
+
+    def __init__(self, size):
+        self.queue = queue.Queue(maxsize=size)
+        self.lost = False
+
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            self.lost = True
+
+
+class EventBroker(metaclass=Singleton):
+    """
+    Class that pushes the topology changes to the subscribers of each worker.
+    A single ChangeDetector thread per worker polls the topology changes while there are subscribers and the broker
+    fans out each change to all of them.
+    Each event is a tuple with the changes token and the list of messages, with the same structure created by the
+    DAOs, or None when the subscribers must reload the whole topology.
+    """
+
+    def __init__(self, poll=Topology.get_changes):
+        """
+        :param poll: Function that receives the previous token and replies the topology changes
+        """
+        self.poll = poll
+        self.interval = ConfReader().get('TOPOLOGY_EVENTS', 'interval')
+        self.queue_size = ConfReader().get('TOPOLOGY_EVENTS', 'queue_size')
+        self.token = None
+        self.__subscribers = set()
+        self.__lock = threading.Lock()
+        self.__detector = None
+
+    def subscribe(self):
+        """
+        Subscribes to the topology events, starting the change detector if needed.
+        :return: Subscriber
+        """
+        subscriber = Subscriber(self.queue_size)
+        with self.__lock:
+            self.__subscribers.add(subscriber)
+            if self.__detector is None or not self.__detector.is_alive():
+                self.__detector = ChangeDetector(self)
+                self.__detector.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.__lock:
+            self.__subscribers.discard(subscriber)
+
+    def has_subscribers(self):
+        with self.__lock:
+            return len(self.__subscribers) > 0
+
+    def detach(self, detector):
+        """
+        Decides, under the subscribe lock, whether a change detector must stop and, if so, detaches it from the broker.
+        A subscriber arriving after the decision then starts a new detector, instead of relying on one that is exiting.
+        :param detector: The ChangeDetector asking
+        :return: Whether the detector must stop
+        """
+        with self.__lock:
+            if len(self.__subscribers) > 0 and not detector.stopped.is_set():
+                return False
+            if self.__detector is detector:
+                self.__detector = None
+            return True
+
+    def publish(self, event):
+        """
+        Sends an event to every subscriber.
+        :param event: Tuple with the changes token and the list of messages, or None to reload the topology
+        """
+        with self.__lock:
+            subscribers = list(self.__subscribers)
+        for subscriber in subscribers:
+            subscriber.put(event)
+
+    def stop(self):
+        """
+        Stops the change detector. A hook to when a worker starts shutting down.
+        """
+        with self.__lock:
+            self.__subscribers.clear()
+            if self.__detector is not None:
+                self.__detector.stopped.set()
+
+
+class ChangeDetector(threading.Thread):
+    """
+    Thread that polls the topology changes and publishes them on the broker.
+    It stops once the broker has no subscribers, and the broker starts a new one on the next subscription.
+    """
+
+    def __init__(self, broker):
+        super(ChangeDetector, self).__init__(name='TopologyChangeDetector', daemon=True)
+        self.broker = broker
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.broker.detach(self):
+            try:
+                self.detect()
+            except Exception:
+                logger.exception('Failed to detect topology changes')
+            self.stopped.wait(self.broker.interval)
+
+    def detect(self):
+        """
+        Polls the changes since the last token and publishes them.
+        The first poll only collects the token, since the subscribers must load the snapshot themselves.
+        """
+        changes = self.broker.poll(self.broker.token)
+        if self.broker.token is not None:
+            if changes.get('reset'):
+                self.broker.publish(None)
+            else:
+                messages = []
+                for key in Topology.LOADER.keys():
+                    messages.extend(changes.get(key))
+                if len(messages) > 0:
+                    self.broker.publish((changes.get('token'), messages))
+        self.broker.token = changes.get('token')
+
+
+def event_stream(last_event_id=None):
+    """
+    Creates a Server-Sent Events stream with the topology changes.
+    Each message is sent as a data field with the changes token as id, so a client that reconnects with the
+    Last-Event-ID header receives the changes it missed. The stream closes after the configured duration, since a
+    request can't outlive the worker timeout, and clients reconnect automatically.
+    :param last_event_id: The token of the last event received by the client
+    :return: Generator of the stream chunks
+    """
+    duration = ConfReader().get('TOPOLOGY_EVENTS', 'duration')
+    keepalive = ConfReader().get('TOPOLOGY_EVENTS', 'keepalive')
+
+    broker = EventBroker()
+    subscriber = broker.subscribe()
+    try:
+        yield 'retry: {}\n\n'.format(int(broker.interval * 1000)).encode('utf-8')
+
+        # Send the changes missed since the last connection
+        if last_event_id:
+            changes = Topology.get_changes(last_event_id)
+            if changes.get('reset'):
+                yield __format_event__(None)
+                return
+            messages = []
+            for key in Topology.LOADER.keys():
+                messages.extend(changes.get(key))
+            if len(messages) > 0:
+                yield __format_event__((changes.get('token'), messages))
+
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            try:
+                event = subscriber.queue.get(timeout=min(keepalive, max(deadline - time.monotonic(), 0)))
+            except queue.Empty:
+                yield b': keepalive\n\n'
+                continue
+
+            if subscriber.lost or event is None:
+                yield __format_event__(None)
+                return
+            yield __format_event__(event)
+    finally:
+        broker.unsubscribe(subscriber)
+
+
+def __format_event__(event):
+    """
+    Formats an event as Server-Sent Events.
+    :param event: Tuple with the changes token and the list of messages, or None to reload the topology
+    :return: Event bytes
+    """
+    if event is None:
+        return b'event: reset\ndata: {}\n\n'
+    token, messages = event
+    return ''.join('id: {}\ndata: {}\n\n'.format(token, json.dumps(message)) for message in messages).encode('utf-8')
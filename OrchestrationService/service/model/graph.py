@@ -0,0 +1,267 @@
+import threading
+import time
+from array import array
+from collections import OrderedDict, namedtuple
+from itertools import accumulate
+
+from service.cache import TTLCache
+from service.conf_reader import ConfReader
+from service.error import handle_topology_exception
+from service.model.db.dao.topology.lte import UEDAO
+from service.model.db.dao.topology.physical import PhysicalDAO
+from service.model.db.dao.topology.virtual import VirtualMachineDAO, VMNetworkDAO
+from service.model.db.db_parser import DBLoader
+from service.model.topology import Topology
+from service.utils import Singleton
+
+Graph = namedtuple('Graph', ['watermark', 'hosts', 'vms', 'networks', 'ues',
+                             'host_vms', 'vm_hosts', 'vm_networks', 'network_vms', 'vm_ues', 'ue_vms'])
+
+
+class Nodes(object):
+    """
+    Keys of a type of node, each node is identified by the position of its key.
+    """
+
+    __slots__ = ('keys', 'index')
+
+    def __init__(self, keys):
+        """
+        :param keys: Iterable with the keys, the repeated and None keys are ignored
+        """
+        self.keys = [key for key in OrderedDict.fromkeys(keys) if key is not None]
+        self.index = {key: idx for idx, key in enumerate(self.keys)}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def get(self, indexes):
+        """
+        :param indexes: Iterable with node indexes
+        :return: List with the keys of the nodes
+        """
+        return [self.keys[idx] for idx in indexes]
+
+
+class Adjacency(object):
+    """
+    Edges from a type of node to another, as compressed sparse rows: the targets of the node i are
+    targets[offsets[i]:offsets[i + 1]], in ascending order.
+    """
+
+    __slots__ = ('offsets', 'targets')
+
+    def __init__(self, size, edges):
+        """
+        :param size: The number of source nodes
+        :param edges: Iterable with the (source, target) node indexes, the repeated edges are ignored
+        """
+        edges = sorted(set(edges))
+        counts = [0] * (size + 1)
+        for source, target in edges:
+            counts[source + 1] += 1
+        self.offsets = array('i', accumulate(counts))
+        self.targets = array('i', (target for source, target in edges))
+
+    def neighbours(self, *sources):
+        """
+        :param sources: Source node indexes
+        :return: Sorted list with the target node indexes of all sources
+        """
+        if len(sources) == 1:
+            return list(self.targets[self.offsets[sources[0]]:self.offsets[sources[0] + 1]])
+        targets = set()
+        for source in sources:
+            targets.update(self.targets[self.offsets[source]:self.offsets[source + 1]])
+        return sorted(targets)
+
+    def transpose(self, size):
+        """
+        :param size: The number of target nodes
+        :return: Adjacency with the edges reversed
+        """
+        return Adjacency(size, ((self.targets[idx], source) for source in range(len(self.offsets) - 1)
+                                for idx in range(self.offsets[source], self.offsets[source + 1])))
+
+
+class TopologyGraph(metaclass=Singleton):
+    """
+    Per worker adjacency model of the topology, answering which VMs, networks and UEs are attached to a host, a
+    network or a VM without joining the tables on every request.
+    The nodes are hosts, VMs, networks and UEs, each type identified by integer indexes, and the edges between two
+    types are kept as integer arrays in compressed sparse rows. A UE is attached to the VM whose network IP is its eNB
+    S1-U IP.
+    Only the keys needed by the edges are read. The graph is checked against the DB watermark on each lookup and only
+    the sections whose watermark moved are read again, then the arrays are rebuilt from the rows kept in memory.
+    The physical and UE sections have no reported time, so an update in place of their rows, e.g. a UE handover to
+    another eNB, doesn't move the watermark. They are also read again once they are older than the TOPOLOGY_CACHE
+    ttl, as on Topology.get_changes.
+    Each rebuild replaces the whole Graph tuple, so the lookups never see a partial rebuild.
+    The watermark is only checked again once its graph_ttl expires, so the lookups may be up to graph_ttl seconds old.
+    """
+
+    # The DB watermark last checked, the graph is answered without checking it again while fresh
+    WATERMARK = TTLCache(ConfReader().get('TOPOLOGY_CACHE', 'graph_ttl'), max_size=1)
+
+    def __init__(self):
+        self.graph = None
+        self.__rows = dict()  # Rows of each LOADER section, by section key
+        self.__read = dict()  # Time each LOADER section was read, by section key
+        self.__lock = threading.Lock()
+
+    def host(self, hostname):
+        """
+        :param hostname: The hostname of the host
+        :return: Ordered dict with the VMs of the host and the networks and UEs of those VMs, None if unknown
+        """
+        graph = self.__graph__()
+        idx = graph.hosts.index.get(hostname)
+        if idx is None:
+            return None
+        vms = graph.host_vms.neighbours(idx)
+        return OrderedDict([
+            ('hostname', hostname),
+            ('vms', graph.vms.get(vms)),
+            ('networks', graph.networks.get(graph.vm_networks.neighbours(*vms))),
+            ('ues', graph.ues.get(graph.vm_ues.neighbours(*vms)))
+        ])
+
+    def network(self, network_id):
+        """
+        :param network_id: The id of the network
+        :return: Ordered dict with the VMs attached to the network and the hosts and UEs of those VMs, None if unknown
+        """
+        graph = self.__graph__()
+        idx = graph.networks.index.get(network_id)
+        if idx is None:
+            return None
+        vms = graph.network_vms.neighbours(idx)
+        return OrderedDict([
+            ('network_id', network_id),
+            ('vms', graph.vms.get(vms)),
+            ('hosts', graph.hosts.get(graph.vm_hosts.neighbours(*vms))),
+            ('ues', graph.ues.get(graph.vm_ues.neighbours(*vms)))
+        ])
+
+    def vm(self, uuid):
+        """
+        :param uuid: The uuid of the VM
+        :return: Ordered dict with the host, networks and UEs of the VM, None if unknown
+        """
+        graph = self.__graph__()
+        idx = graph.vms.index.get(uuid)
+        if idx is None:
+            return None
+        hosts = graph.hosts.get(graph.vm_hosts.neighbours(idx))
+        return OrderedDict([
+            ('uuid', uuid),
+            ('hostname', hosts[0] if len(hosts) > 0 else None),
+            ('networks', graph.networks.get(graph.vm_networks.neighbours(idx))),
+            ('ues', graph.ues.get(graph.vm_ues.neighbours(idx)))
+        ])
+
+    def __graph__(self):
+        """
+        The current graph, rebuilt when the DB watermark moved since it was built.
+        :return: Graph
+        """
+        if self.graph is not None and \
+                TopologyGraph.WATERMARK.get('watermark', validator=self.graph.watermark) is not None:
+            return self.graph
+
+        bind = DBLoader().read_bind()  # The watermark and the sections it validates are read from the same DB
+        watermark = Topology.get_watermark(bind)
+        TopologyGraph.WATERMARK.set('watermark', watermark, validator=watermark)
+        if self.graph is None or self.graph.watermark != watermark or self.__stale__():
+            with self.__lock:
+                if self.graph is None or self.graph.watermark != watermark or self.__stale__():
+                    self.refresh(watermark, bind)
+        return self.graph
+
+    def __stale__(self):
+        """
+        :return: Set with the keys of the sections whose changes don't move the watermark, read before the
+        TOPOLOGY_CACHE ttl
+        """
+        return {key for key, obj in Topology.LOADER.items() if not obj.__tracks_changes__() and
+                time.monotonic() - self.__read.get(key, 0) >= Topology.SNAPSHOT_CACHE.ttl}
+
+    @handle_topology_exception
+    def refresh(self, watermark, bind=None):
+        """
+        Reads the sections whose watermark moved or are stale, see __stale__, and rebuilds the graph.
+        :param watermark: The current DB watermark
+        :param bind: The engine the watermark was read from, see DBLoader.read_bind
+        """
+        previous = dict(zip(Topology.LOADER.keys(), self.graph.watermark)) if self.graph is not None else dict()
+        readers = dict(physical=self.__read_physical__, virtual=self.__read_virtual__, ue=self.__read_ue__)
+        stale = self.__stale__()
+        session = DBLoader().create_session(read_only=True, bind=bind)
+        try:
+            for key, section in zip(Topology.LOADER.keys(), watermark):
+                if key not in self.__rows or previous.get(key) != section or key in stale:
+                    self.__rows[key] = readers.get(key)(session)
+                    self.__read[key] = time.monotonic()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+        self.graph = self.__build__(watermark)
+
+    @staticmethod
+    def __read_physical__(session):
+        """
+        :return: List with the hostnames
+        """
+        return [row[0] for row in session.query(getattr(PhysicalDAO.TABLE.c, PhysicalDAO.DB_MAP.get(PhysicalDAO.KEY)))]
+
+    @staticmethod
+    def __read_virtual__(session):
+        """
+        :return: Tuple with the (uuid, hostname) of the VMs and the (uuid, network id, ip) of the VM networks
+        """
+        foreign_key = VirtualMachineDAO.DB_MAP.get(VirtualMachineDAO.FOREIGN_KEY)
+        vm_columns = [getattr(VirtualMachineDAO.TABLE.c, VirtualMachineDAO.DB_MAP.get(field))
+                      for field in [VirtualMachineDAO.FOREIGN_KEY, 'hostname']]
+        network_columns = [getattr(VMNetworkDAO.TABLE.c, foreign_key)] + \
+            [getattr(VMNetworkDAO.TABLE.c, VMNetworkDAO.DB_MAP.get(field)) for field in ['network_id', 'ip']]
+        return [tuple(row) for row in session.query(*vm_columns)], \
+               [tuple(row) for row in session.query(*network_columns)]
+
+    @staticmethod
+    def __read_ue__(session):
+        """
+        :return: List with the (IMSI, eNB S1-U IP) of the UEs
+        """
+        columns = [getattr(UEDAO.TABLE.c, UEDAO.DB_MAP.get(field)) for field in [UEDAO.KEY, 'enb_ip_s1u']]
+        return [tuple(row) for row in session.query(*columns)]
+
+    def __build__(self, watermark):
+        """
+        Builds the nodes and edges from the rows kept in memory.
+        :param watermark: The DB watermark of the rows
+        :return: Graph
+        """
+        vm_rows, network_rows = self.__rows.get('virtual')
+        ue_rows = self.__rows.get('ue')
+
+        hosts = Nodes(self.__rows.get('physical') + [hostname for uuid, hostname in vm_rows])
+        vms = Nodes(uuid for uuid, hostname in vm_rows)
+        networks = Nodes(network_id for uuid, network_id, ip in network_rows)
+        ues = Nodes(imsi for imsi, enb_ip in ue_rows)
+
+        vm_hosts = Adjacency(len(vms), ((vms.index[uuid], hosts.index[hostname]) for uuid, hostname in vm_rows
+                                        if hostname is not None))
+        vm_networks = Adjacency(len(vms), ((vms.index[uuid], networks.index[network_id])
+                                           for uuid, network_id, ip in network_rows
+                                           if uuid in vms.index and network_id is not None))
+
+        vm_ips = {ip: vms.index[uuid] for uuid, network_id, ip in network_rows if uuid in vms.index and ip is not None}
+        ue_vms = Adjacency(len(ues), ((ues.index[imsi], vm_ips[enb_ip]) for imsi, enb_ip in ue_rows
+                                      if enb_ip in vm_ips))
+
+        return Graph(watermark, hosts, vms, networks, ues,
+                     vm_hosts.transpose(len(hosts)), vm_hosts,
+                     vm_networks, vm_networks.transpose(len(networks)),
+                     ue_vms.transpose(len(vms)), ue_vms)
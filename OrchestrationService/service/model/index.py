@@ -0,0 +1,190 @@
+import logging
+import threading
+from collections import OrderedDict, namedtuple
+
+from service.conf_reader import ConfReader
+from service.error import handle_topology_exception
+from service.model.db.dao.abstract import ABSDao
+from service.model.db.dao.topology.lte import UEDAO
+from service.model.db.dao.topology.virtual import VirtualMachineDAO
+from service.model.db.db_parser import DBLoader
+from service.utils import Singleton
+
+logger = logging.getLogger(__name__)
+
+Indexes = namedtuple('Indexes', ['ue_ip', 'enb', 'location', 'hostname'])
+
+
+class TopologyIndex(metaclass=Singleton):
+    """
+    Per worker in-memory indexes of the topology lookups that would otherwise scan the DB on every request:
+    UE IP to the UE rows, the eNB IPs, the VM locations and the hostname to the VM rows.
+    The indexes are built in a single pass over the lte and vm tables and refreshed every interval by an
+    IndexRefresher thread. The UEs are read again on each refresh, since the lte table has no reported time, while only
+    the VMs whose reported time changed are read again.
+    Each refresh replaces the whole Indexes tuple, so the lookups never see a partial refresh.
+    """
+
+    def __init__(self):
+        self.enabled = ConfReader().get('TOPOLOGY_INDEX', 'enabled')
+        self.interval = ConfReader().get('TOPOLOGY_INDEX', 'interval')
+        self.indexes = None
+        self.__vms = OrderedDict()  # VM rows by uuid
+        self.__vm_versions = dict()  # VM reported time by uuid
+        self.__lock = threading.Lock()
+        self.__refresher = None
+
+    def start(self):
+        """
+        Starts the refresher thread. A hook to when a worker starts, so each worker refreshes its own indexes.
+        """
+        with self.__lock:
+            if self.__refresher is None or not self.__refresher.is_alive():
+                self.__refresher = IndexRefresher(self)
+                self.__refresher.start()
+
+    def stop(self):
+        """
+        Stops the refresher thread. A hook to when a worker starts shutting down.
+        """
+        with self.__lock:
+            if self.__refresher is not None:
+                self.__refresher.stopped.set()
+
+    def ues_by_ip(self, ip):
+        """
+        :param ip: The UE IP
+        :return: List with a copy of the UE rows, keyed by the DAO fields
+        """
+        return [UEDAO.__label_row__(row) for row in self.__indexes__().ue_ip.get(ip, [])]
+
+    def enbs(self):
+        """
+        :return: List with the distinct eNB IPs
+        """
+        return list(self.__indexes__().enb)
+
+    def locations(self):
+        """
+        :return: List with the distinct VM locations
+        """
+        return list(self.__indexes__().location)
+
+    def vms_by_hostname(self, hostname, *filter_by):
+        """
+        :param hostname: The hostname of the VMs
+        :param filter_by: The columns to keep in each row, all columns when none is provided
+        :return: List with a copy of the VM rows, keyed by the DAO fields
+        """
+        rows = self.__indexes__().hostname.get(hostname, [])
+        return [VirtualMachineDAO.__label_row__(row, *filter_by) for row in rows]
+
+    def __indexes__(self):
+        """
+        The current indexes, built on the first lookup if the refresher didn't build them yet.
+        :return: Indexes
+        """
+        if self.indexes is None:
+            self.refresh()
+        return self.indexes
+
+    @handle_topology_exception
+    def refresh(self):
+        """
+        Reads the UEs and the changed VMs, and replaces the indexes.
+        """
+        with self.__lock:
+            session = DBLoader().create_session(read_only=True)
+            try:
+                ue_ip, enb = self.__index_ues__(session)
+                changed = self.__refresh_vms__(session)
+                if self.indexes is None or changed:
+                    location, hostname = self.__index_vms__()
+                else:
+                    location, hostname = self.indexes.location, self.indexes.hostname
+            except Exception:
+                session.rollback()
+                raise
+            finally:
+                session.close()
+            self.indexes = Indexes(ue_ip, enb, location, hostname)
+
+    @staticmethod
+    def __index_ues__(session):
+        """
+        Indexes all UEs in one pass.
+        :param session: The DB connection to use in the queries
+        :return: Tuple with the dict of UE IP to UE rows and the distinct eNB IPs
+        """
+        ip, enb_ip = UEDAO.DB_MAP.get('ue_ip'), UEDAO.DB_MAP.get('enb_ip_s1u')
+        columns = UEDAO.TABLE.columns.keys()
+        ue_ip = dict()
+        enb = OrderedDict()
+        for row in UEDAO(session).query_all():
+            row = dict(zip(columns, row))
+            ue_ip.setdefault(row.get(ip), []).append(row)
+            enb[row.get(enb_ip)] = None
+        return ue_ip, tuple(enb.keys())
+
+    def __refresh_vms__(self, session):
+        """
+        Reads the VMs created or changed since the last refresh and forgets the removed ones.
+        Only the uuid and reported time of every VM are read, unless the table has no reported time.
+        :param session: The DB connection to use in the queries
+        :return: Whether any VM changed
+        """
+        dao = VirtualMachineDAO(session)
+        key = VirtualMachineDAO.DB_MAP.get(VirtualMachineDAO.KEY)
+        columns = VirtualMachineDAO.TABLE.columns.keys()
+
+        if not VirtualMachineDAO.__tracks_changes__():
+            self.__vms = OrderedDict((row.get(key), row) for row in (dict(zip(columns, r)) for r in dao.query_all()))
+            return True
+
+        versions = dict(session.query(getattr(VirtualMachineDAO.TABLE.c, key),
+                                      getattr(VirtualMachineDAO.TABLE.c, ABSDao.REPORTED_TIME)).all())
+        changed = [uuid for uuid, version in versions.items() if self.__vm_versions.get(uuid) != version]
+        removed = [uuid for uuid in self.__vm_versions.keys() if uuid not in versions]
+
+        vms = OrderedDict(self.__vms)
+        for uuid in removed:
+            vms.pop(uuid, None)
+        for row in dao.query_by_keys(key, changed):
+            row = dict(zip(columns, row))
+            vms[row.get(key)] = row
+
+        self.__vms = vms
+        self.__vm_versions = versions
+        return len(changed) > 0 or len(removed) > 0
+
+    def __index_vms__(self):
+        """
+        Indexes the VM rows kept in memory.
+        :return: Tuple with the distinct locations and the dict of hostname to VM rows
+        """
+        location, hostname = VirtualMachineDAO.DB_MAP.get('location'), VirtualMachineDAO.DB_MAP.get('hostname')
+        locations = OrderedDict()
+        hostnames = dict()
+        for row in self.__vms.values():
+            locations[row.get(location)] = None
+            hostnames.setdefault(row.get(hostname), []).append(row)
+        return tuple(locations.keys()), hostnames
+
+
+class IndexRefresher(threading.Thread):
+    """
+    Thread that refreshes the topology indexes every interval, until the index is stopped.
+    """
+
+    def __init__(self, index):
+        super(IndexRefresher, self).__init__(name='TopologyIndexRefresher', daemon=True)
+        self.index = index
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                self.index.refresh()
+            except Exception:
+                logger.exception('Failed to refresh the topology indexes')
+            self.stopped.wait(self.index.interval)
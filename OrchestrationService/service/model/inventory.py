@@ -1,9 +1,16 @@
 from service.model.topology import Topology
-from service.model.db.dao.topology.virtual import VirtualMachineDAO, VMNetworkDAO
 from service.error import handle_topology_exception
 
 
 class InventoryRepresentation(object):
+    """
+    Record of the inventory objects replied by the API.
+    The records have no instance dict, since a service builds one record per app and network service, and are
+    serialized by to_dict with their fields in the order they are set.
+    """
+
+    __slots__ = ('id', 'created', 'status', 'type')
+    FIELDS = __slots__  # Serialized fields, in order. Unset fields are left out, e.g., created of the inner objects
 
     @classmethod
     def build_from_dict(cls, d):
@@ -20,11 +27,41 @@ class InventoryRepresentation(object):
         self.status = status
         self.type = obj_type
 
+    def to_dict(self):
+        """
+        Plain representation of the record, encoded as JSON exactly like jsonpickle.encode(record, unpicklable=False).
+        :return: Dict with the set fields, inner records are converted as well
+        """
+        d = dict()
+        for name in type(self).FIELDS:
+            if hasattr(self, name):
+                d[name] = InventoryRepresentation.__plain__(getattr(self, name))
+        return d
+
+    @staticmethod
+    def __plain__(value):
+        if isinstance(value, InventoryRepresentation):
+            return value.to_dict()
+        if isinstance(value, list):
+            return [InventoryRepresentation.__plain__(item) for item in value]
+        return value
+
 
 class Service(InventoryRepresentation):
 
+    __slots__ = ('info', 'lifecycle', 'related_services', 'network_services', 'sdn_apps')
+    FIELDS = InventoryRepresentation.FIELDS + __slots__
+
+    EXPAND = ('apps', 'vms')  # Inner objects replied in detail when requested, otherwise only by id
+    DEFAULT_EXPAND = ('apps',)
+
     @classmethod
-    def build_from_dict(cls, d):
+    def build_from_dict(cls, d, expand=DEFAULT_EXPAND):
+        """
+        :param d: The service document
+        :param expand: The inner objects to build in detail, see EXPAND. The VMs imply the apps.
+        :return: Service
+        """
         created = d.get('created_at')
         status = d.get('service_status')
         service_type = d.get('service_type')
@@ -33,17 +70,30 @@ class Service(InventoryRepresentation):
         lifecycle_status = d.get('lifecycle_status')
         related_services = d.get('related_services')
 
+        # Query the VMs of all apps at once, only when their details are requested
+        vms = None
+        if 'vms' in expand:
+            vm_ids = [vm_id for app in d.get('apps', {}) for vm_id in APP.__vm_ids__(app) or []]
+            vms = Topology().get_vms_by_uuid(vm_ids, labelled=True)
+
         sdn_apps = [
-            APP.build_from_dict(app) for app in d.get('apps', {})
+            APP.build_from_dict(app, vms, expand_vms=vms is not None) for app in d.get('apps', {})
             if 'VNF' not in app.get('app_class') and not app.get('ns_instance_id', None)
         ]
 
         network_services = []
         for ns in d.get('network_services'):
             ns_instance = NetworkService.build_from_dict(ns)
-            Service.__build_network_services__(ns_instance, d.get('apps', {}))
+            Service.__build_network_services__(ns_instance, d.get('apps', {}), vms)
             network_services.append(ns_instance)
 
+        # Reply only the ids of the apps when they aren't requested
+        if 'apps' not in expand and 'vms' not in expand:
+            sdn_apps = [app.id for app in sdn_apps]
+            for ns in network_services:
+                ns.apps = [app.id for app in ns.apps]
+                ns.sdn_apps = [app.id for app in ns.sdn_apps]
+
         return Service(
             status, service_type, service_id, created,
             service_info, lifecycle_status, related_services,
@@ -51,10 +101,11 @@ class Service(InventoryRepresentation):
         )
 
     @classmethod
-    def __build_network_services__(cls, ns, apps):
+    def __build_network_services__(cls, ns, apps, vms=None):
         for app in apps:
             if app.get('ns_instance_id') == ns.id:
-                ns.append_app(APP.build_from_dict(app), sdn='VNF' not in app.get('app_class'))
+                ns.append_app(APP.build_from_dict(app, vms, expand_vms=vms is not None),
+                              sdn='VNF' not in app.get('app_class'))
 
     def __init__(self, status, obj_type, obj_id, created,
                  service_info, lifecycle_status, related_services,
@@ -69,6 +120,9 @@ class Service(InventoryRepresentation):
 
 class NetworkService(InventoryRepresentation):
 
+    __slots__ = ('nfvo', 'apps', 'sdn_apps')
+    FIELDS = InventoryRepresentation.FIELDS + __slots__
+
     @classmethod
     def build_from_dict(cls, d_ns):
         ns_status = d_ns.get('ns_status')
@@ -95,35 +149,51 @@ class NetworkService(InventoryRepresentation):
 
 class APP(InventoryRepresentation):
 
+    __slots__ = ('app_class', 'location', 'vm_ids', 'virtual_machines')
+    FIELDS = InventoryRepresentation.FIELDS + __slots__
+
     @classmethod
-    def build_from_dict(cls, d):
+    def build_from_dict(cls, d, vms=None, expand_vms=True):
+        """
+        :param d: The app document
+        :param vms: The VMs already queried by uuid, as replied by Topology.get_vms_by_uuid labelled. When not provided
+        the VMs of the app are queried.
+        :param expand_vms: Whether to build the VMs in detail, otherwise only their ids are kept
+        :return: APP
+        """
         app_class = d.get('app_class')
         app_type = d.get('app_type')
         location = d.get('location')
         app_instance_id = d.get('app_instance_id')
         status = d.get('status')
-        vm_ids = None
+        vm_ids = APP.__vm_ids__(d)
+        return APP(status, app_type, app_instance_id, app_class, location, vm_ids, queried_vms=vms,
+                   expand_vms=expand_vms)
+
+    @staticmethod
+    def __vm_ids__(d):
+        """
+        :param d: The app document
+        :return: List with the VM ids of the app, or None if it has no VMs
+        """
         if d.get('vm_ids', None):
-            vm_ids = [vm.get('vim_vm_id', None) for vm in d.get('vm_ids', None)]
-        return APP(status, app_type, app_instance_id, app_class, location, vm_ids)
+            return [vm.get('vim_vm_id', None) for vm in d.get('vm_ids', None)]
+        return None
 
     @handle_topology_exception
-    def __init__(self, status, obj_type, obj_id, app_class, location, vms=None):
+    def __init__(self, status, obj_type, obj_id, app_class, location, vms=None, queried_vms=None, expand_vms=True):
         super(APP, self).__init__(status, obj_type, obj_id)
         self.app_class = app_class
         self.location = location
-        if vms:
+        self.vm_ids = vms
+        if vms and expand_vms:
+            if queried_vms is None:
+                queried_vms = Topology().get_vms_by_uuid(vms, labelled=True)
             self.virtual_machines = []
             for vm in vms:
-                vm__ = Topology().query_by_multiple_filters(VirtualMachineDAO.TABLE, clean=False, uuid=vm)
-                vm__ = vm__[0]
-                for key, value in VirtualMachineDAO.DB_MAP.items():
-                    if value in vm__.keys():
-                        vm__[key] = vm__.pop(value)
-                vm__['network'] = []
-                for net in Topology().query_by_multiple_filters(VMNetworkDAO.TABLE, clean=False, uuid=vm):
-                    for key, value in VMNetworkDAO.DB_MAP.items():
-                        if value in net.keys():
-                            net[key] = net.pop(value)
-                    vm__['network'].append(net)
+                if vm not in queried_vms:
+                    continue
+                # Copy the queried VM, since it may be shared with other apps
+                vm__ = dict(queried_vms.get(vm))
+                vm__['network'] = [dict(net) for net in vm__.pop('network', [])]
                 self.virtual_machines.append(vm__)
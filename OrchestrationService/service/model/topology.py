@@ -1,11 +1,24 @@
+import hashlib
+import itertools
+import json
 import logging
+import os
+import re
+import tempfile
+import time
 from collections import OrderedDict
 
+from sqlalchemy import bindparam, func, not_
+from sqlalchemy.ext import baked
+
 from service.model.db.dao.topology.lte import UEDAO
-from service.model.db.dao.topology.virtual import VirtualMachineDAO
+from service.model.db.dao.topology.virtual import VirtualMachineDAO, VMNetworkDAO
 from service.model.db.dao.topology.physical import PhysicalDAO
 from service.model.db.db_parser import DBLoader
-from service.utils import Singleton
+from service.cache import SharedFileCache, TTLCache
+from service.executor import Executor
+from service.conf_reader import ConfReader
+from service.utils import SEARCH_NEGATION, Singleton, split_search_key
 from service.error import handle_topology_exception
 
 logger = logging.getLogger(__name__)
@@ -23,65 +36,620 @@ class Topology(metaclass=Singleton):
     LOADER['virtual'] = VirtualMachineDAO
     LOADER['ue'] = UEDAO
 
+    IN_CHUNK_SIZE = 500  # Maximum number of keys sent in a single IN clause
+    STREAM_BUFFER = 65536  # Number of characters sent at a time when streaming the topology
+    LIKE_ESCAPE = '/'  # Escapes the LIKE wildcards found on the search values
+
+    # SQL predicate of each search operator, comparing a column with the bound parameter of the value
+    OPERATORS = {
+        'eq': lambda column, value: column == value,
+        'ne': lambda column, value: column != value,
+        'gt': lambda column, value: column > value,
+        'gte': lambda column, value: column >= value,
+        'lt': lambda column, value: column < value,
+        'lte': lambda column, value: column <= value,
+        'in': lambda column, value: column.in_(value),
+        'like': lambda column, value: column.like(value, escape=Topology.LIKE_ESCAPE),
+        'prefix': lambda column, value: column.like(value, escape=Topology.LIKE_ESCAPE)
+    }
+
+    # Queries built and compiled once per shape: table, selected columns and criteria columns and operators
+    BAKERY = baked.bakery(size=ConfReader().get('TOPOLOGY_CACHE', 'statements_size'))
+
+    # The serialized topology and each of its sections
+    SNAPSHOT_CACHE = TTLCache(ConfReader().get('TOPOLOGY_CACHE', 'ttl'), max_size=len(LOADER) + 1)
+
+    # The serialized topology and each of its sections shared by the workers of the host
+    SHARED_SNAPSHOT = SharedFileCache(
+        ConfReader().get('TOPOLOGY_CACHE', 'shared_directory'),
+        ConfReader().get('TOPOLOGY_CACHE', 'ttl')
+    )
+
+    # Row counts of each grouping and criteria, kept briefly since they are requested by the dashboards polling
+    STATS_CACHE = TTLCache(
+        ConfReader().get('TOPOLOGY_CACHE', 'stats_ttl'),
+        max_size=ConfReader().get('TOPOLOGY_CACHE', 'stats_size')
+    )
+
+    # Versions of the messages by the time each changes token was issued, needed to find changes and removals. They
+    # are kept on files shared by the workers of the host, so a token issued by any worker is known to all of them.
+    CHANGES_HISTORY = SharedFileCache(
+        os.path.join(ConfReader().get('TOPOLOGY_CACHE', 'shared_directory') or
+                     os.path.join(tempfile.gettempdir(), 'nbi_orchestration'), 'changes'),
+        ConfReader().get('TOPOLOGY_CACHE', 'changes_ttl')
+    )
+    TOKEN_PATTERN = re.compile('[0-9a-f]{40}')  # The SHA-1 hex digests created by __create_token__
+
     @staticmethod
-    def get_topology():
+    def get_topology(watermark=None, bind=None):
         """
         Creates the current topology.
-        If topology dict is empty it queries the DB otherwise it will be returned as is.
-        Because object references are used, a copy of the topology is sent in case the object is being read by a
-        client and invalidated during the operation,
-        allowing the client to keep the messages and receive the new ones only.
+        The topology is decoded from its serialized form, so each caller gets its own copy and can keep the messages
+        even if the topology is invalidated during the operation.
+        :param watermark: The current DB watermark, queried when not provided and the snapshot cache is enabled
+        :param bind: The engine the watermark was read from, see DBLoader.read_bind
         :return: A dict with the current topology.
         """
-        DBLoader().get_table('pm')
-        return Topology.__load_topology__()
+        topology = Topology.get_serialized_topology(watermark, bind=bind)
+        if not isinstance(topology, bytes):
+            topology = b''.join(topology)
+        return json.loads(topology.decode('utf-8'), object_pairs_hook=OrderedDict)
+
+    @staticmethod
+    def get_serialized_topology(watermark=None, sections=None, bind=None):
+        """
+        Creates the current topology serialized as JSON.
+        The serialized topology and each of its sections are kept in the snapshot cache, and a section is only queried
+        again when it expires or its DB watermark moves, i.e., any of its tables changed. The missing sections are
+        loaded concurrently on the worker Executor, each with its own session. When the cache is disabled the sections
+        are streamed from the DB one after another instead, so the whole topology is never kept in memory.
+        :param watermark: The current DB watermark, queried when not provided and the snapshot cache is enabled
+        :param sections: The keys of the LOADER sections to reply, all sections by default
+        :param bind: The engine the watermark was read from, see DBLoader.read_bind. All the sections are read from it,
+        so they match the watermark they are cached with. Chosen when not provided.
+        :return: The JSON bytes when the cache is enabled, otherwise a generator of JSON chunks
+        """
+        sections = list(Topology.LOADER.keys()) if sections is None else list(sections)
+        bind = DBLoader().read_bind() if bind is None else bind
+        if Topology.SNAPSHOT_CACHE.enabled:
+            watermark = Topology.get_watermark(bind) if watermark is None else watermark
+            key = 'snapshot' if sections == list(Topology.LOADER.keys()) else None
+            topology = Topology.SNAPSHOT_CACHE.get(key, validator=watermark) if key else None
+            if topology is None:
+                topology = Topology.__join_sections__(sections, Topology.__load_sections__(watermark, sections, bind))
+                if key:
+                    Topology.SNAPSHOT_CACHE.set(key, topology, validator=watermark)
+            return topology
+
+        stream = Topology.__stream_topology__(sections, bind)
+        first = next(stream)  # Run the first query before replying, so DB errors are still reported as such
+        return itertools.chain([first], stream)
 
     @staticmethod
-    def __load_topology__():
+    def open_serialized_topology(sections=None):
+        """
+        Opens the serialized topology on the snapshot cache shared by the workers of the host, so it's only queried
+        and kept once per host instead of once per worker. The first worker finding it stale serializes it again while
+        the rest wait for it, validated against the watermark of its sections. The sections are serialized straight
+        into the shared file, without keeping them on the worker snapshot cache.
+        :param sections: The keys of the LOADER sections to reply, all sections by default
+        :return: Tuple with the file positioned at the JSON bytes and their length, or the get_serialized_topology
+        result when the shared cache is disabled
         """
-        Loads the topology into the dictionary.
-        It uses the class mapping with the key to use and the DAO to obtain the snapshot.
-        The topology must be saved in an ordered dict to send the messages as they were introduced in the system.
-        :return: Ordered Dict with the topology.
+        if not Topology.SHARED_SNAPSHOT.enabled:
+            return Topology.get_serialized_topology(sections=sections)
+
+        sections = list(Topology.LOADER.keys()) if sections is None else list(sections)
+        key = '-'.join(['snapshot'] + (sections if sections != list(Topology.LOADER.keys()) else []))
+        bind = DBLoader().read_bind()
+        watermark = Topology.get_watermark(bind)
+        validator = hashlib.sha1(repr([section for k, section in zip(Topology.LOADER.keys(), watermark)
+                                       if k in sections]).encode('utf-8')).hexdigest()
+
+        entry = Topology.SHARED_SNAPSHOT.open(key, validator=validator)
+        if entry is not None:
+            return entry
+        with Topology.SHARED_SNAPSHOT.lock(key):
+            entry = Topology.SHARED_SNAPSHOT.open(key, validator=validator)  # Refreshed while waiting for the lock
+            if entry is not None:
+                return entry
+            topology = Topology.__join_sections__(
+                sections, dict(zip(sections, Executor().map(Topology.__serialize_section__, sections,
+                                                            [bind] * len(sections)))))
+            generation = Topology.SHARED_SNAPSHOT.set(key, topology, validator=validator)
+            logger.info('Shared topology {} refreshed, generation {}'.format(key, generation))
+            return Topology.SHARED_SNAPSHOT.open(key, validator=validator) or topology
+
+    @staticmethod
+    def __join_sections__(sections, loaded):
         """
-        topology = OrderedDict()
-        for key, obj in Topology.LOADER.items():
+        :param sections: The keys of the LOADER sections, in the reply order
+        :param loaded: Dict with the section key as key and the JSON bytes of its messages as value
+        :return: The JSON bytes of the topology
+        """
+        return b'{' + b', '.join(json.dumps(k).encode('utf-8') + b': ' + loaded.get(k) for k in sections) + b'}'
+
+    @staticmethod
+    def __load_sections__(watermark, sections, bind):
+        """
+        Gets the serialized sections from the snapshot cache, loading the missing ones concurrently.
+        :param watermark: The current DB watermark, each section is validated against its own watermark
+        :param sections: The keys of the LOADER sections
+        :param bind: The engine the watermark was read from
+        :return: Dict with the section key as key and the JSON bytes of its messages as value
+        """
+        validators = dict(zip(Topology.LOADER.keys(), watermark))
+        loaded = dict()
+        for key in sections:
+            section = Topology.SNAPSHOT_CACHE.get(key, validator=validators.get(key))
+            if section is not None:
+                loaded[key] = section
+
+        missing = [key for key in sections if key not in loaded]
+        for key, section in zip(missing, Executor().map(Topology.__serialize_section__, missing,
+                                                        [bind] * len(missing))):
+            Topology.SNAPSHOT_CACHE.set(key, section, validator=validators.get(key))
+            loaded[key] = section
+        return loaded
+
+    @staticmethod
+    @handle_topology_exception
+    def __serialize_section__(key, bind=None):
+        """
+        Queries the messages of a section, with its own session.
+        :param key: The key of the LOADER section
+        :param bind: The engine to read from, see DBLoader.read_bind
+        :return: The JSON bytes of the section messages
+        """
+        session = DBLoader().create_session(read_only=True, bind=bind)
+        try:
+            messages = [json.dumps(message) for message in Topology.LOADER.get(key)(session).snapshot()]
+            return ('[' + ', '.join(messages) + ']').encode('utf-8')
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    @staticmethod
+    def __stream_topology__(sections, bind=None):
+        """
+        Streams the topology as JSON, section by section.
+        It uses the class mapping with the key to use and the DAO to stream the messages.
+        The topology is kept in order to send the messages as they were introduced in the system.
+        The output is the same json.dumps creates for the whole topology, but only a buffer of STREAM_BUFFER
+        characters and a batch of rows are kept in memory.
+        :param sections: The keys of the LOADER sections to stream
+        :param bind: The engine to read all the sections from, see DBLoader.read_bind
+        :return: Generator of JSON chunks
+        """
+        buffer = ['{']
+        size = 1
+        for idx, key in enumerate(sections):
+            buffer.append('{}{}: ['.format(', ' if idx > 0 else '', json.dumps(key)))
+            session = DBLoader().create_session(read_only=True, bind=bind)
             try:
-                session = DBLoader().create_session()
-                topology[key] = obj(session).snapshot()
+                for count, message in enumerate(Topology.LOADER.get(key)(session).stream()):
+                    message = json.dumps(message)
+                    buffer.append(', ' + message if count > 0 else message)
+                    size += len(buffer[-1])
+                    if size >= Topology.STREAM_BUFFER:
+                        yield ''.join(buffer).encode('utf-8')
+                        buffer, size = [], 0
             except Exception:
+                logger.exception('DB error: Topology stream')
                 session.rollback()
                 raise
             finally:
                 session.close()
-        return topology
+            buffer.append(']')
+
+        buffer.append('}')
+        yield ''.join(buffer).encode('utf-8')
+
+    @staticmethod
+    def get_changes(token=None):
+        """
+        Creates the messages created, changed or removed since a previous changes request.
+        Each reply carries a token identifying the topology it reflects, which must be sent on the next request.
+        Removed rows are sent as DELETE messages (tombstones).
+        Only the sections whose watermark moved are read and the VMs are read by their reported time, so polling an
+        unchanged topology costs a single watermark query. The physical and UE sections have no reported time, so an
+        update in place of their rows doesn't move the watermark and is only sent once the section is read again,
+        after the snapshot cache ttl.
+        The state of each token is kept as JSON on the changes history shared by the workers of the host. When no
+        token is provided, or the token is unknown (e.g. expired) or malformed, the whole topology is sent and reset is
+        set to true.
+        :param token: Token of the previous reply
+        :return: Ordered dict with the token, the reset flag and the messages of each section
+        """
+        # The token names a file of the history, so only the tokens this method creates are looked up
+        valid = token is not None and Topology.TOKEN_PATTERN.fullmatch(token) is not None
+        previous = Topology.CHANGES_HISTORY.get(token) if valid else None
+        previous = json.loads(previous.decode('utf-8')) if previous is not None else None
+
+        # The watermark and the changes it validates are read from the same DB. The DB of the previous state is read
+        # again, since a replica lagging behind it would reply its newest rows as removed.
+        bind = DBLoader().read_bind(preferred=previous.get('bind') if previous is not None else None)
+        watermark = Topology.get_watermark(bind)
+
+        changes = OrderedDict()
+        changes['token'] = None
+        changes['reset'] = previous is None
+        state = dict(watermark=json.loads(json.dumps(watermark, default=str)), versions=OrderedDict(),
+                     fingerprints=OrderedDict(), read=OrderedDict(),
+                     bind=DBLoader.bind_url(bind))  # Compared as read back from the history
+        topology = None
+
+        for idx, (key, obj) in enumerate(Topology.LOADER.items()):
+            unchanged = previous is not None and previous['watermark'][idx] == state['watermark'][idx]
+            if unchanged and (obj.__tracks_changes__() or
+                              time.time() - previous['read'][key] < Topology.SNAPSHOT_CACHE.ttl):
+                for item in ['versions', 'fingerprints', 'read']:
+                    state[item][key] = previous[item][key]
+                changes[key] = []
+                continue
+
+            if previous is None:
+                topology = Topology.get_topology(watermark, bind) if topology is None else topology
+                changes[key] = topology[key]
+                state['versions'][key] = obj.versions(changes[key])
+            else:
+                session = DBLoader().create_session(read_only=True, bind=bind)
+                try:
+                    changes[key], state['versions'][key] = obj(session).changes(previous['watermark'][idx],
+                                                                                previous['versions'][key])
+                except Exception:
+                    session.rollback()
+                    raise
+                finally:
+                    session.close()
+
+                removed = [k for k in previous['versions'][key].keys() if k not in state['versions'][key]]
+                changes[key] = changes[key] + [obj.__create_tombstone__(k) for k in removed]
+
+            state['fingerprints'][key] = obj.__digest__(sorted(state['versions'][key].items()))
+            state['read'][key] = time.time()  # Wall clock, since the state is read by other workers
+
+        changes['token'] = Topology.__create_token__(state['watermark'], state['fingerprints'])
+        Topology.CHANGES_HISTORY.set(changes['token'], json.dumps(state).encode('utf-8'))
+        Topology.CHANGES_HISTORY.evict(ConfReader().get('TOPOLOGY_CACHE', 'changes_history'))
+        return changes
+
+    @staticmethod
+    def __create_token__(watermark, fingerprints):
+        """
+        Creates an opaque token for a topology state. The same state always creates the same token.
+        :param watermark: The DB watermark
+        :param fingerprints: The fingerprint of the versions of each section
+        :return: Token string
+        """
+        return hashlib.sha1(json.dumps([watermark, fingerprints], default=str).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def invalidate():
+        """
+        Invalidates the cached topology, forcing the next request to query a new one.
+        """
+        Topology.SNAPSHOT_CACHE.invalidate()
+
+    @staticmethod
+    @handle_topology_exception
+    def get_watermark(bind=None):
+        """
+        Queries, in a single statement, the aggregates of every topology table that change when its rows change.
+        :param bind: The engine to read from, see DBLoader.read_bind. It must be the one the watermarked data is read
+        from, since each replica may lag differently.
+        :return: Tuple with the watermark of each topology section, in the LOADER order
+        """
+        watermark = []
+        sizes = []
+        for obj in Topology.LOADER.values():
+            section = obj.__watermark__()
+            watermark.extend(section)
+            sizes.append(len(section))
+
+        session = DBLoader().create_session(read_only=True, bind=bind)
+        try:
+            row = tuple(session.query(*watermark).one())
+            sections = []
+            for size in sizes:
+                sections.append(row[:size])
+                row = row[size:]
+            return tuple(sections)
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    @handle_topology_exception
+    def query_by_multiple_filters(self, table, *filter_by, clean=True, labels=None, **kwargs):
+        """
+        Query the rows of a table matching all the criteria.
+        When the rows must be cleaned only the filter_by columns are selected, so the DB sends only those.
+        :param table: The table to query
+        :param filter_by: The columns to keep in each row when clean is True
+        :param clean: Whether the rows must be reduced to the filter_by columns
+        :param labels: The DAO labels of the table columns, see ABSDao.__labels__. When provided the rows are keyed by
+        the labels instead of the column names.
+        :param kwargs: Search criteria, see __criteria__
+        :return: List with the rows as dicts
+        """
+        columns = self.__projection__(table, clean, *filter_by, labels=labels)
+        keys = [c.key for c in columns]
+        shape, criteria, params = self.__criteria__(table, **kwargs)
+        query = Topology.BAKERY(lambda session: self.__select__(session, table, columns).filter(*criteria),
+                                table.name, tuple(keys), labels is not None, shape)
+        session = DBLoader().create_session(read_only=True)
+        try:
+            objs = query(session).params(**params).all()
+            return [dict(zip(keys, row)) for row in objs]
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
 
     @handle_topology_exception
-    def query_by_multiple_filters(self, table, *filter_by, clean=True, **kwargs):
-        session = DBLoader().create_session()
+    def query_page(self, table, key_column, limit, cursor, *filter_by, clean=True, labels=None, **kwargs):
+        """
+        Query a page of rows using keyset pagination: the rows are ordered by a unique key column and only the rows
+        after the cursor key are read, so each page costs the same regardless of its position.
+        :param table: The table to query
+        :param key_column: The unique column used to order the rows, e.g. the primary key
+        :param limit: Maximum number of rows in the page
+        :param cursor: The key of the last row of the previous page, None for the first page
+        :param filter_by: The columns to keep in each row when clean is True
+        :param clean: Whether the rows must be reduced to the filter_by columns
+        :param labels: The DAO labels of the table columns, to key the rows by them
+        :param kwargs: Additional search criteria, see __criteria__
+        :return: Tuple with the rows and the key of the last row, or None when there are no more rows
+        """
+        column = getattr(table.c, key_column)
+        columns = self.__projection__(table, clean, key_column, *filter_by, labels=labels)
+        keys = [c.key for c in columns]
+        key_label = labels.get(key_column) if labels else key_column
+        remove_key = clean and key_column not in filter_by  # The key is only selected to create the cursor
+        shape, criteria, params = self.__criteria__(table, **kwargs)
+        query = Topology.BAKERY(lambda session: self.__select__(session, table, columns).filter(*criteria),
+                                table.name, tuple(keys), labels is not None, shape, key_column)
+        if cursor is not None:
+            query += lambda q: q.filter(column > bindparam('cursor'))
+            params['cursor'] = cursor
+        query += lambda q: q.order_by(column).limit(bindparam('limit'))
+        session = DBLoader().create_session(read_only=True)
         try:
-            objs = session.query(table).filter_by(**kwargs).all()
+            # One extra row tells if there is a next page
+            objs = query(session).params(limit=limit + 1, **params).all()
             response = []
-            for row in objs:
-                r = dict(zip(table.columns.keys(), row))
-                if clean:
-                    self.__clean_filter__(r, table, *filter_by)
+            next_key = None
+            for row in objs[:limit]:
+                r = dict(zip(keys, row))
+                next_key = r.pop(key_label) if remove_key else r.get(key_label)
                 response.append(r)
-            return response
+            return response, next_key if len(objs) > limit else None
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    @handle_topology_exception
+    def query_keys_page(self, table, key_column, limit, cursor, **kwargs):
+        """
+        Query a page of the distinct values of a column, e.g. the VMs with networks matching a criteria, using
+        keyset pagination.
+        :param table: The table to query
+        :param key_column: The column with the values to page
+        :param limit: Maximum number of values in the page
+        :param cursor: The last value of the previous page, None for the first page
+        :param kwargs: Additional search criteria, see __criteria__
+        :return: Tuple with the values and the last value, or None when there are no more values
+        """
+        column = getattr(table.c, key_column)
+        shape, criteria, params = self.__criteria__(table, **kwargs)
+        query = Topology.BAKERY(lambda session: session.query(column).filter(*criteria), table.name, key_column, shape)
+        if cursor is not None:
+            query += lambda q: q.filter(column > bindparam('cursor'))
+            params['cursor'] = cursor
+        query += lambda q: q.distinct().order_by(column).limit(bindparam('limit'))
+        session = DBLoader().create_session(read_only=True)
+        try:
+            keys = [row[0] for row in query(session).params(limit=limit + 1, **params).all()]
+            return keys[:limit], keys[limit - 1] if len(keys) > limit else None
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    @handle_topology_exception
+    def query_by_foreign_keys(self, table, column_name, keys, *filter_by, clean=True, labels=None, **kwargs):
+        """
+        Query all the rows of a table related to a group of keys, e.g. all the networks of a list of VMs.
+        Instead of one query per key the keys are sent in IN clauses, split in chunks of IN_CHUNK_SIZE.
+        The column used to relate the rows is always kept, so the rows can be grouped by it.
+        :param table: The table to query
+        :param column_name: The column holding the keys
+        :param keys: Iterable with the keys to search for
+        :param filter_by: The columns to keep in each row when clean is True
+        :param clean: Whether the rows must be reduced to the filter_by columns
+        :param labels: The DAO labels of the table columns, to key the rows by them
+        :param kwargs: Additional search criteria, see __criteria__
+        :return: Dict with the key as key and the list of related rows as value, in the order they were queried
+        """
+        keys = list(OrderedDict.fromkeys(keys))
+        grouped = OrderedDict()
+        if len(keys) == 0:
+            return grouped
+
+        column = getattr(table.c, column_name)
+        columns = self.__projection__(table, clean, column_name, *filter_by, labels=labels)
+        names = [c.key for c in columns]
+        key_label = labels.get(column_name) if labels else column_name
+        shape, criteria, params = self.__criteria__(table, **kwargs)
+        query = Topology.BAKERY(
+            lambda session: self.__select__(session, table, columns).filter(
+                column.in_(bindparam('keys', expanding=True)), *criteria),
+            table.name, tuple(names), labels is not None, shape, column_name)
+        session = DBLoader().create_session(read_only=True)
+        try:
+            for idx in range(0, len(keys), Topology.IN_CHUNK_SIZE):
+                chunk = keys[idx:idx + Topology.IN_CHUNK_SIZE]
+                objs = query(session).params(keys=chunk, **params).all()
+                for row in objs:
+                    r = dict(zip(names, row))
+                    grouped.setdefault(r.get(key_label), []).append(r)
+            return grouped
         except Exception:
             session.rollback()
             raise
         finally:
             session.close()
 
-    def __clean_filter__(self, r, table, *filter_by):
-        for f in table.columns.keys():
-            if f not in filter_by:
-                r.pop(f)
+    @handle_topology_exception
+    def count_by(self, table, *group_by, labels=None, **kwargs):
+        """
+        Counts the rows of a table matching all the criteria, grouped by the values of the group_by columns.
+        The rows are grouped and counted by the DB, so only one row per group is read. The counts are kept in the
+        stats cache.
+        :param table: The table to query
+        :param group_by: The columns to group by, none to count all rows
+        :param labels: The DAO labels of the table columns, to key the groups by them
+        :param kwargs: Search criteria, see __criteria__
+        :return: List with a dict per group, with the group_by columns and the count, ordered by the group_by columns
+        """
+        key = (table.name, group_by, tuple(sorted(kwargs.items())))
+        stats = Topology.STATS_CACHE.get(key)
+        if stats is not None:
+            return stats
+
+        columns = [getattr(table.c, column) for column in group_by]
+        names = [labels.get(column, column) if labels else column for column in group_by] + ['count']
+        shape, criteria, params = self.__criteria__(table, **kwargs)
+        query = Topology.BAKERY(
+            lambda session: session.query(*columns, func.count()).select_from(table).filter(*criteria),
+            table.name, group_by, shape)
+        if len(columns) > 0:
+            query += lambda q: q.group_by(*columns).order_by(*columns)
+        session = DBLoader().create_session(read_only=True)
+        try:
+            stats = [OrderedDict(zip(names, row)) for row in query(session).params(**params).all()]
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+        Topology.STATS_CACHE.set(key, stats)
+        return stats
+
+    def get_vms_by_uuid(self, uuids, vm_columns=(), network_columns=(), networks=True, labelled=False):
+        """
+        Query a group of VMs with their networks, with one IN query per table split in chunks of IN_CHUNK_SIZE.
+        The queries of both tables and all chunks are independent, so they run concurrently on the worker Executor.
+        :param uuids: Iterable with the VM uuids, the ones not found are ignored
+        :param vm_columns: The VM columns to keep in each VM, all columns when empty. The uuid is always kept.
+        :param network_columns: The network columns to keep in each network, all columns when empty.
+        The uuid is always kept.
+        :param networks: Whether to query the networks, set on each VM as a list under the network key
+        :param labelled: Whether the VMs and networks are keyed by their DAO labels instead of the column names
+        :return: Ordered dict with the uuid as key and the VM row as value, in the order of the uuids
+        """
+        foreign_key = VirtualMachineDAO.DB_MAP.get(VirtualMachineDAO.FOREIGN_KEY)
+        uuids = list(OrderedDict.fromkeys(uuids))
+        chunks = [uuids[idx:idx + Topology.IN_CHUNK_SIZE] for idx in range(0, len(uuids), Topology.IN_CHUNK_SIZE)]
+
+        tables = [(VirtualMachineDAO, vm_columns)]
+        if networks:
+            tables.append((VMNetworkDAO, network_columns))
+        queries = [(dao, columns, chunk) for dao, columns in tables for chunk in chunks]
+
+        results = Executor().map(
+            lambda dao, columns, chunk: self.query_by_foreign_keys(
+                dao.TABLE, foreign_key, chunk, *columns, clean=len(columns) > 0,
+                labels=dao.__labels__() if labelled else None),
+            *zip(*queries)
+        )
+
+        rows = {dao.TABLE.name: dict() for dao, columns in tables}
+        for (dao, columns, chunk), result in zip(queries, results):
+            rows.get(dao.TABLE.name).update(result)
+
+        vm_rows = rows.get(VirtualMachineDAO.TABLE.name)
+        vms = OrderedDict((uuid, vm_rows.get(uuid)[0]) for uuid in uuids if uuid in vm_rows)
+        if networks:
+            network_rows = rows.get(VMNetworkDAO.TABLE.name)
+            for uuid, vm in vms.items():
+                vm['network'] = network_rows.get(uuid, [])
+        return vms
+
+    @staticmethod
+    def __projection__(table, clean, *filter_by, labels=None):
+        """
+        Columns to select from a table, in the table order, or labelled in the labels order.
+        :param table: The table to query
+        :param clean: Whether the rows must be reduced to the filter_by columns
+        :param filter_by: The columns to keep, names that aren't table columns are ignored
+        :param labels: The DAO labels of the table columns, see ABSDao.__labels__
+        :return: List with the columns
+        """
+        if labels:
+            return [getattr(table.c, column).label(label) for column, label in labels.items()
+                    if not clean or column in filter_by]
+        return [c for c in table.columns if not clean or c.key in filter_by]
+
+    @staticmethod
+    def __select__(session, table, columns):
+        """
+        :return: Query selecting the columns, or the table rows when no column is selected
+        """
+        return session.query(*columns) if len(columns) > 0 else session.query(table)
+
+    @staticmethod
+    def __criteria__(table, **kwargs):
+        """
+        Compiles the search criteria into SQL predicates over bound parameters, so the statement only depends on the
+        columns and operators of the criteria, i.e., its shape, and can be baked.
+        :param kwargs: Column names, optionally suffixed with a search operator, e.g. reportedTime__gt or
+        hostName__not_in, and the values to compare with, an iterable of values for the in operators
+        :return: Tuple with the shape, the list of predicates and the dict with the values of the bound parameters
+        """
+        shape, criteria, params = [], [], dict()
+        for idx, key in enumerate(sorted(kwargs.keys())):
+            column, operator = split_search_key(key)
+            operator = operator or 'eq'
+            negated = operator.startswith(SEARCH_NEGATION)
+            if negated:
+                operator = operator[len(SEARCH_NEGATION):]
+
+            name = 'criteria_{}'.format(idx)
+            predicate = Topology.OPERATORS.get(operator)(getattr(table.c, column),
+                                                         bindparam(name, expanding=operator == 'in'))
+            criteria.append(not_(predicate) if negated else predicate)
+            params[name] = Topology.__search_value__(operator, kwargs.get(key))
+            shape.append(key)
+        return tuple(shape), criteria, params
+
+    @staticmethod
+    def __search_value__(operator, value):
+        """
+        :param operator: The search operator, without negation
+        :param value: The value of the search criteria
+        :return: The value of the bound parameter. The LIKE wildcards of the value are escaped, with * matching any
+        characters on like and the value followed by any characters on prefix.
+        """
+        if operator == 'in':
+            return list(value)
+        if operator in ('like', 'prefix'):
+            escape = Topology.LIKE_ESCAPE
+            value = value.replace(escape, escape * 2).replace('%', escape + '%').replace('_', escape + '_')
+            return value.replace('*', '%') if operator == 'like' else value + '%'
+        return value
 
     @handle_topology_exception
     def get_all_locations(self):
-        session = DBLoader().create_session()
+        session = DBLoader().create_session(read_only=True)
         try:
             locations_ = session.query(VirtualMachineDAO.CLASS.location).distinct().all()
             locations = []
@@ -96,7 +664,7 @@ class Topology(metaclass=Singleton):
 
     @handle_topology_exception
     def get_enb(self):
-        session = DBLoader().create_session()
+        session = DBLoader().create_session(read_only=True)
         try:
             enb_ = session.query(UEDAO.CLASS.enbIPS1U).distinct().all()
             enb = []
@@ -16,6 +16,8 @@ def handle_exception(function):
         service = kwargs.get('service_name', 'Service')
         try:
             r = function(*args, **kwargs)
+            if r.status_code == 304:  # Only replied to conditional requests, the caller keeps the content
+                return r
             if r.status_code == 404:
                 raise HTTPNotFound()
             if r.status_code == 500:
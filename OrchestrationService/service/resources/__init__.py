@@ -5,6 +5,8 @@ import jsonschema
 
 import jsonpickle
 
+from service.utils import encode_cursor, pagination_links
+
 __all__ = ['inventory', 'topology']
 
 
@@ -17,9 +19,37 @@ class BaseResource(object):
     def format_body(self, data, from_dict=False):
         if from_dict:
             return json.dumps(data)
-        data = jsonpickle.encode(data, unpicklable=False)
+        data = BaseResource.__to_dict__(data)
+        try:
+            # Plain data is encoded by json the same as by jsonpickle, only much faster
+            return json.dumps(data)
+        except (TypeError, ValueError):
+            return jsonpickle.encode(data, unpicklable=False)
+
+    @staticmethod
+    def __to_dict__(data):
+        """
+        Converts the records with a to_dict serializer, e.g., the inventory model, to plain data.
+        :param data: A record, a list of records or any other data, kept as is
+        :return: The plain data
+        """
+        if hasattr(data, 'to_dict'):
+            return data.to_dict()
+        if isinstance(data, list):
+            return [BaseResource.__to_dict__(item) for item in data]
         return data
 
+    def format_page(self, req, name, items, next_key):
+        """
+        Formats a page of items with the pagination links.
+        :param req: The request of the page
+        :param name: The field holding the items
+        :param items: The items of the page
+        :param next_key: The key of the last item, None if this is the last page
+        :return: JSON string
+        """
+        return self.format_body({name: items, 'links': pagination_links(req, encode_cursor(next_key))}, from_dict=True)
+
 
 class ComplexEncoder(json.JSONEncoder):
     def default(self, obj):
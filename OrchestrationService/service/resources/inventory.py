@@ -1,11 +1,12 @@
-from falcon import HTTP_200, HTTPNotFound
+from falcon import HTTP_200, HTTPBadRequest, HTTPNotFound
 
+from service.cache import TTLCache
+from service.executor import Executor
 from service.resources import BaseResource
 from service.conf_reader import ConfReader
 from service.requester import request
 from service.model.inventory import InventoryRepresentation, Service
 from service.model.topology import Topology
-from service.model.db.dao.topology.virtual import VirtualMachineDAO, VMNetworkDAO
 
 SERVICE_NAME = 'Service Inventory'
 
@@ -16,11 +17,75 @@ class Services(BaseResource):
         "/services/{s_id}"
     ]
 
+    # Inventory documents by service id, with the services built from each for every expand. The documents are reused
+    # by the nested routes while fresh and revalidated with the inventory afterwards.
+    CACHE = TTLCache(
+        ConfReader().get('SERVICE_INVENTORY', 'cache_ttl'),
+        max_size=ConfReader().get('SERVICE_INVENTORY', 'cache_size')
+    )
+
+    @staticmethod
+    def __parse_expand__(req, *required):
+        """
+        Parse the expand query parameter, the inner objects of the services replied in detail.
+        E.g. expand=apps,vms replies the apps with their VMs, while expand=none replies only the ids of the apps.
+        :param req: The request
+        :param required: Inner objects always expanded by the route
+        :return: Tuple with the inner objects to expand
+        """
+        expand = req.get_param_as_list('expand')
+        if expand is None:
+            expand = Service.DEFAULT_EXPAND
+
+        # NOTE: Falcon may not split the comma separated values, depending on its options
+        expand = set(e for value in expand for e in value.split(',') if e != 'none')
+        if not expand.issubset(Service.EXPAND):
+            raise HTTPBadRequest(
+                title='Invalid expand',
+                description='The expand values must be none or any of {}'.format(', '.join(Service.EXPAND)),
+                code='004'
+            )
+        return tuple(sorted(expand.union(required)))
+
     @staticmethod
-    def __request_service__(s_id):
-        endpoint = '{}/{}'.format(ConfReader().get('SERVICE_INVENTORY', 'url'), s_id)
-        r = request(endpoint, service_name=SERVICE_NAME)
-        return Service.build_from_dict(r.json())
+    def __request_service__(s_id, expand=Service.DEFAULT_EXPAND):
+        """
+        Get a service from the inventory.
+        The inventory document of a service is cached by its id, and a service built from it is reused for the same
+        expand while the document is fresh. Once expired, the inventory is asked for the document with the ETag or
+        Last-Modified of the cached one, when provided by the inventory, and if it didn't change only the topology
+        information is built again, from the cached document.
+        :param s_id: The service id
+        :param expand: The inner objects to build in detail
+        :return: Service
+        """
+        entry = Services.CACHE.get_entry(s_id)
+        if entry is not None and entry.age() < Services.CACHE.ttl:
+            cached = entry.value
+        else:
+            headers = dict()
+            if entry is not None and entry.validator is not None:
+                etag, last_modified = entry.validator
+                if etag:
+                    headers['If-None-Match'] = etag
+                if last_modified:
+                    headers['If-Modified-Since'] = last_modified
+
+            endpoint = '{}/{}'.format(ConfReader().get('SERVICE_INVENTORY', 'url'), s_id)
+            r = request(endpoint, headers=headers, service_name=SERVICE_NAME)
+            if r.status_code == 304 and entry is not None:
+                document, validator = entry.value.get('document'), entry.validator
+            else:
+                document, validator = r.json(), (r.headers.get('ETag'), r.headers.get('Last-Modified'))
+
+            cached = dict(document=document, services=dict())
+            Services.CACHE.set(s_id, cached, validator if validator and any(validator) else None)
+
+        service = cached.get('services').get(expand)
+        if service is None:
+            service = Service.build_from_dict(cached.get('document'), expand)
+            cached.get('services')[expand] = service
+        return service
 
     def on_get(self, req, resp, **kwargs):
         if kwargs and 's_id' in kwargs:
@@ -32,14 +97,20 @@ class Services(BaseResource):
         r = request(ConfReader().get('SERVICE_INVENTORY', 'url'), service_name=SERVICE_NAME)
         services = []
         for service in r.json():
-            services.append(InventoryRepresentation.build_from_dict(service).__dict__)
+            services.append(InventoryRepresentation.build_from_dict(service).to_dict())
+
+        # Request the details of all services concurrently
+        if req.get_param_as_bool('detail'):
+            expand = Services.__parse_expand__(req)
+            services = Executor().map(
+                lambda service: Services.__request_service__(service.get('id'), expand), services)
 
         resp.status = HTTP_200
         resp.body = self.format_body(services)
 
     def get_instance(self, req, resp, s_id, **kwargs):
         resp.body = self.format_body(
-            Services.__request_service__(s_id)
+            Services.__request_service__(s_id, Services.__parse_expand__(req))
         )
 
 
@@ -56,11 +127,11 @@ class NetworkServices(BaseResource):
             self.get_all(req, resp, **kwargs)
 
     def get_all(self, req, resp, **kwargs):
-        s = Services.__request_service__(kwargs.get('s_id'))
+        s = Services.__request_service__(kwargs.get('s_id'), Services.__parse_expand__(req))
         resp.body = self.format_body(s.network_services)
 
     def get_instance(self, req, resp, ns_id, **kwargs):
-        s = Services.__request_service__(kwargs.get('s_id'))
+        s = Services.__request_service__(kwargs.get('s_id'), Services.__parse_expand__(req))
         for ns in s.network_services:
             if ns.id == ns_id:
                 resp.body = self.format_body(ns)
@@ -81,11 +152,11 @@ class SDNAPPs(BaseResource):
             self.get_all(req, resp, **kwargs)
 
     def get_all(self, req, resp, **kwargs):
-        s = Services.__request_service__(kwargs.get('s_id'))
+        s = Services.__request_service__(kwargs.get('s_id'), Services.__parse_expand__(req, 'apps'))
         resp.body = self.format_body(s.sdn_apps)
 
     def get_instance(self, req, resp, app_id, **kwargs):
-        s = Services.__request_service__(kwargs.get('s_id'))
+        s = Services.__request_service__(kwargs.get('s_id'), Services.__parse_expand__(req, 'apps'))
         for app in s.sdn_apps:
             if app.id == app_id:
                 resp.body = self.format_body(app)
@@ -113,11 +184,11 @@ class VNFAPPs(BaseResource):
             self.get_all(req, resp, **kwargs)
 
     def get_all(self, req, resp, **kwargs):
-        s = Services.__request_service__(kwargs.get('s_id'))
+        s = Services.__request_service__(kwargs.get('s_id'), Services.__parse_expand__(req, 'apps'))
         resp.body = self.format_body(VNFAPPs.__get_apps__(s, kwargs.get('ns_id')))
 
     def get_instance(self, req, resp, app_id, **kwargs):
-        s = Services.__request_service__(kwargs.get('s_id'))
+        s = Services.__request_service__(kwargs.get('s_id'), Services.__parse_expand__(req, 'apps'))
         apps = VNFAPPs.__get_apps__(s, kwargs.get('ns_id'))
         for app in apps:
             if app.id == app_id:
@@ -148,23 +219,16 @@ class VMs(BaseResource):
 
     def get_all(self, req, resp, **kwargs):
         s = Services.__request_service__(kwargs.get('s_id'))
-        vms = self.__get_vms__(s, kwargs.get('ns_id'), kwargs.get('app_id'))
-        virtual_machines = []
-        for vm in vms:
-            vm__ = Topology().query_by_multiple_filters(VirtualMachineDAO.TABLE, clean=False, uuid=vm)[0]
-            vm__['network'] = []
-            for net in Topology().query_by_multiple_filters(VMNetworkDAO.TABLE, clean=False, uuid=vm):
-                vm__['network'].append(net)
-            virtual_machines.append(vm__)
-            resp.body = self.format_body(dict(vms=virtual_machines), from_dict=True)
+        vms = self.__get_vms__(s, kwargs.get('ns_id'), kwargs.get('app_id')) or []
+        virtual_machines = Topology().get_vms_by_uuid(vms)
+        resp.body = self.format_body(dict(vms=list(virtual_machines.values())), from_dict=True)
 
     def get_instance(self, req, resp, **kwargs):
         s = Services.__request_service__(kwargs.get('s_id'))
-        vms = self.__get_vms__(s, kwargs.get('ns_id'), kwargs.get('app_id'))
-        for vm in vms:
-            if vm == kwargs.get('vm_id'):
-                vm__ = Topology().query_by_multiple_filters(VirtualMachineDAO.TABLE, clean=False, uuid=vm)[0]
-                vm__['network'] = []
-                for net in Topology().query_by_multiple_filters(VMNetworkDAO.TABLE, clean=False, uuid=vm):
-                    vm__['network'].append(net)
-        resp.body = self.format_body(vm__, from_dict=True)
\ No newline at end of file
+        vms = self.__get_vms__(s, kwargs.get('ns_id'), kwargs.get('app_id')) or []
+        if kwargs.get('vm_id') not in vms:
+            raise HTTPNotFound()
+        virtual_machines = Topology().get_vms_by_uuid([kwargs.get('vm_id')])
+        if kwargs.get('vm_id') not in virtual_machines:
+            raise HTTPNotFound()
+        resp.body = self.format_body(virtual_machines.get(kwargs.get('vm_id')), from_dict=True)
\ No newline at end of file
@@ -1,10 +1,18 @@
-from falcon import HTTP_NOT_IMPLEMENTED, HTTPError, before
+from collections import OrderedDict
+
+from falcon import HTTP_NOT_IMPLEMENTED, HTTPBadRequest, HTTPError, HTTPNotFound, before
 
 from service.model.topology import Topology
-from service.resources import BaseResource
-from service.utils import parse_multiple_parameters
+from service.model.events import event_stream
+from service.model.graph import TopologyGraph
+from service.model.index import TopologyIndex
+from service.resources import BaseResource, validate
+from service.schema import load_schema
+from service.conf_reader import ConfReader
+from service.utils import parse_multiple_parameters, parse_pagination, translate_search_key
 from service.model.db.dao.topology.virtual import VirtualMachineDAO, VMNetworkDAO
 from service.model.db.dao.topology.lte import UEDAO
+from service.model.db.db_parser import DBLoader
 
 
 SERVICE_NAME = 'Topology'
@@ -18,8 +26,88 @@ class Snapshot(BaseResource):
     ]
 
     def on_get(self, req, resp):
-        topology = Topology.get_topology()
-        resp.body = self.format_body(topology, from_dict=True)
+        Snapshot.__reply__(resp, Topology.open_serialized_topology())
+
+    @staticmethod
+    def __reply__(resp, topology):
+        if isinstance(topology, bytes):
+            resp.data = topology
+        elif isinstance(topology, tuple):
+            # Shared snapshot file, sent with wsgi.file_wrapper if available
+            resp.stream, resp.content_length = topology
+        else:
+            resp.stream = topology
+
+
+class SnapshotSection(BaseResource):
+
+    ROUTES = [
+        '/topology/snapshot/{section}',
+        '/topology/snapshot/{section}/'
+    ]
+
+    def on_get(self, req, resp, section):
+        """
+        Replies a single section of the topology snapshot, e.g., virtual, with the same format as the snapshot.
+        :return:
+        200 OK - Object with the section messages
+        404 Not Found - Unknown section
+        """
+        if section not in Topology.LOADER:
+            raise HTTPNotFound()
+        Snapshot.__reply__(resp, Topology.open_serialized_topology(sections=[section]))
+
+
+class SnapshotChanges(BaseResource):
+
+    ROUTES = [
+        '/topology/snapshot/changes',
+        '/topology/snapshot/changes/'
+    ]
+
+    def on_get(self, req, resp):
+        """
+        Replies the topology messages created, changed or removed since the reply of the since token, with the token
+        to send on the next request. The tokens are known by every worker of the host until the TOPOLOGY_CACHE
+        changes_ttl expires.
+        NOTE: The physical and UE rows have no reported time, so their updates in place are only replied once the
+        TOPOLOGY_CACHE ttl expires. Their insertions and removals are replied right away.
+        :return:
+        200 OK - Object with the token, the reset flag, true when the whole topology is replied, and the messages of
+        each section
+        """
+        changes = Topology.get_changes(req.get_param('since'))
+        resp.body = self.format_body(changes, from_dict=True)
+
+
+class TopologyEvents(BaseResource):
+
+    ROUTES = [
+        '/topology/events',
+        '/topology/events/'
+    ]
+
+    def on_get(self, req, resp):
+        """
+        Streams the topology changes as Server-Sent Events.
+        Each stream holds a worker thread for the TOPOLOGY_EVENTS duration, so the route is refused on single threaded
+        workers, where a stream would block every other request of the worker.
+        :return:
+        200 OK - Event stream
+        501 Not Implemented - The GUNICORN workers have a single thread
+        """
+        if ConfReader().get('GUNICORN', 'threads') <= 1:
+            raise HTTPError(
+                HTTP_NOT_IMPLEMENTED,
+                title='Events not available',
+                description='The event streams need more than one GUNICORN thread per worker',
+                code='007'
+            )
+
+        resp.content_type = 'text/event-stream'
+        resp.set_header('Cache-Control', 'no-cache')
+        resp.set_header('X-Accel-Buffering', 'no')  # Avoid proxies from buffering the events
+        resp.stream = event_stream(req.get_header('Last-Event-ID'))
 
 
 class TopologyLTEUser(BaseResource):
@@ -29,14 +117,32 @@ class TopologyLTEUser(BaseResource):
         '/topology/lte/ue/ip/{ip}/'
     ]
 
+    @before(parse_pagination)
     def on_get(self, req, resp, ip):
-        ues = Topology().query_by_multiple_filters(
-            UEDAO.TABLE,
-            clean=False,
-            UEIP=ip
-        )
-        ue = [TopologyVM.translate_db_to_dao(ue, UEDAO.DB_MAP) for ue in ues]
-        resp.body = self.format_body(ue, from_dict=True)
+        page = req.context.get('page')
+        if page is None and TopologyIndex().enabled:
+            ues = TopologyIndex().ues_by_ip(ip)
+        elif page is None:
+            ues = Topology().query_by_multiple_filters(
+                UEDAO.TABLE,
+                clean=False,
+                labels=UEDAO.__labels__(),
+                UEIP=ip
+            )
+        else:
+            ues, next_key = Topology().query_page(
+                UEDAO.TABLE,
+                UEDAO.DB_MAP.get(UEDAO.KEY),
+                page.get('limit'),
+                page.get('cursor'),
+                clean=False,
+                labels=UEDAO.__labels__(),
+                UEIP=ip
+            )
+        if page is None:
+            resp.body = self.format_body(ues, from_dict=True)
+        else:
+            resp.body = self.format_page(req, 'ues', ues, next_key)
 
 
 class ENB(BaseResource):
@@ -47,7 +153,8 @@ class ENB(BaseResource):
     ]
 
     def on_get(self, req, resp):
-        resp.body = self.format_body(dict(enb=Topology().get_enb()), from_dict=True)
+        enb = TopologyIndex().enbs() if TopologyIndex().enabled else Topology().get_enb()
+        resp.body = self.format_body(dict(enb=enb), from_dict=True)
 
 
 class TopologyVM(BaseResource):
@@ -58,6 +165,7 @@ class TopologyVM(BaseResource):
     ]
 
     @before(parse_multiple_parameters)
+    @before(parse_pagination)
     def on_get(self, req, resp, **kwargs):
 
         # Create the filter fields
@@ -68,14 +176,14 @@ class TopologyVM(BaseResource):
         search_vm = dict()
         search_network = dict()
 
-        # Translates the search criteria to DB fields
+        # Translates the search criteria to DB fields, keeping their operators
         for key in req.query_context.get('search_by').keys():
 
-            if key in VirtualMachineDAO.DB_MAP.keys():
-                new_key = VirtualMachineDAO.DB_MAP.get(key)
+            if translate_search_key(key, VirtualMachineDAO.DB_MAP) is not None:
+                new_key = translate_search_key(key, VirtualMachineDAO.DB_MAP)
                 search_vm[new_key] = req.query_context.get('search_by').get(key)
-            elif key in VMNetworkDAO.DB_MAP.keys():
-                new_key = VMNetworkDAO.DB_MAP.get(key)
+            elif translate_search_key(key, VMNetworkDAO.DB_MAP) is not None:
+                new_key = translate_search_key(key, VMNetworkDAO.DB_MAP)
                 search_network[new_key] = req.query_context.get('search_by').get(key)
 
         # Translates the filter criteria to DB fields
@@ -103,33 +211,52 @@ class TopologyVM(BaseResource):
         # Check if the result must be filtered
         clean = len(vm_columns) > 1 or len(network_columns) > 0
 
-        # Search VMs
-        vms = Topology().query_by_multiple_filters(
-            VirtualMachineDAO.TABLE,
-            *vm_columns,
-            clean=clean,
-            **search_vm
-        )
+        # Search VMs, a page of them ordered by the foreign key when paginated, keyed by the DAO fields
+        page = req.context.get('page')
+        hostname = VirtualMachineDAO.DB_MAP.get('hostname')
+        if page is None and TopologyIndex().enabled and list(search_vm.keys()) == [hostname]:
+            vms = TopologyIndex().vms_by_hostname(search_vm.get(hostname), *(vm_columns if clean else []))
+        elif page is None:
+            vms = Topology().query_by_multiple_filters(
+                VirtualMachineDAO.TABLE,
+                *vm_columns,
+                clean=clean,
+                labels=VirtualMachineDAO.__labels__(),
+                **search_vm
+            )
+        else:
+            vms, next_key = Topology().query_page(
+                VirtualMachineDAO.TABLE,
+                foreign_key,
+                page.get('limit'),
+                page.get('cursor'),
+                *vm_columns,
+                clean=clean,
+                labels=VirtualMachineDAO.__labels__(),
+                **search_vm
+            )
 
         # Check if network result must be filtered
         clean = len(network_columns) > 0
-        to_remove = []
+        to_remove = set()
 
-        # Translates the DB fields to DAO fields
-        vms = [TopologyVM.translate_db_to_dao(vm, VirtualMachineDAO.DB_MAP) for vm in vms]
+        # Search the networks of all VMs at once, grouped by the foreign key
+        vm_networks = Topology().query_by_foreign_keys(
+            VMNetworkDAO.TABLE,
+            foreign_key,
+            [vm.get(VirtualMachineDAO.FOREIGN_KEY) for vm in vms],
+            *network_columns,
+            clean=clean,
+            labels=VMNetworkDAO.__labels__(),
+            **search_network
+        )
 
         for idx, vm in enumerate(vms):
-            search_network[foreign_key] = vm.get(VirtualMachineDAO.FOREIGN_KEY)  # Append the foreign key
-            networks = Topology().query_by_multiple_filters(
-                VMNetworkDAO.TABLE,
-                *network_columns,
-                clean=clean,
-                **search_network
-            )
+            networks = vm_networks.get(vm.get(VirtualMachineDAO.FOREIGN_KEY), [])
 
             # Remove the VM if network criteria don't match
             if len(networks) == 0 and len(network_columns) > 0:
-                to_remove.append(idx)
+                to_remove.add(idx)
                 continue
 
             # Append the network if the network was requested
@@ -139,18 +266,17 @@ class TopologyVM(BaseResource):
 
             vm['network'] = []
             for n in networks:
-                # Translates the DB fields to DAO fields
-                n = TopologyVM.translate_db_to_dao(n, VMNetworkDAO.DB_MAP)
                 n.pop('uuid', None)
                 vm['network'].append(n)
 
         vms = [i for j, i in enumerate(vms) if j not in to_remove]  # Clean empty network VMs
-        resp.body = self.format_body(vms, from_dict=True)
+        if page is None:
+            resp.body = self.format_body(vms, from_dict=True)
+        else:
+            resp.body = self.format_page(req, 'vms', vms, next_key)
 
     def __search_vm_by_network(self, req, resp, vm_columns, network_columns, search_vm, search_network):
 
-        vms = []
-
         foreign_key = VirtualMachineDAO.DB_MAP.get(VirtualMachineDAO.FOREIGN_KEY)
 
         # Append the foreign_key (uuid) if not already provided
@@ -160,58 +286,193 @@ class TopologyVM(BaseResource):
 
         clean = len(network_columns) > 1  # Check if the network result must be filtered
 
-        networks = Topology().query_by_multiple_filters(
-            VMNetworkDAO.TABLE,
-            *network_columns,
+        page = req.context.get('page')
+        if page is None:
+            networks = Topology().query_by_multiple_filters(
+                VMNetworkDAO.TABLE,
+                *network_columns,
+                clean=clean,
+                labels=VMNetworkDAO.__labels__(),
+                **search_network
+            )
+        else:
+            # Page the VMs with matching networks, then search the networks of those VMs
+            uuids, next_key = Topology().query_keys_page(
+                VMNetworkDAO.TABLE,
+                foreign_key,
+                page.get('limit'),
+                page.get('cursor'),
+                **search_network
+            )
+            vm_networks = Topology().query_by_foreign_keys(
+                VMNetworkDAO.TABLE,
+                foreign_key,
+                uuids,
+                *network_columns,
+                clean=clean,
+                labels=VMNetworkDAO.__labels__(),
+                **search_network
+            )
+            networks = [n for uuid in uuids for n in vm_networks.get(uuid, [])]
+
+        clean = len(vm_columns) > 1 or len(network_columns) > 1  # Check if the result must be filtered
+
+        # Search all the parent VMs at once, indexed by the foreign key
+        parents = Topology().query_by_foreign_keys(
+            VirtualMachineDAO.TABLE,
+            foreign_key,
+            [n.get(foreign_key) for n in networks],
+            *vm_columns,
             clean=clean,
-            **search_network
+            labels=VirtualMachineDAO.__labels__()
         )
 
-        clean = len(vm_columns) > 1 or len(network_columns) > 1  # Check if the result must be filtered
-        for n in networks:
-            vm = Topology().query_by_multiple_filters(
-                VirtualMachineDAO.TABLE,
-                *vm_columns,
-                clean=clean,
-                uuid=n.get('uuid')
-            )
+        append_network = 'network' in vm_columns \
+            or len(network_columns) > 1 \
+            or len(network_columns) == 1 and len(vm_columns) == 1
 
-            if vm:
-                vm = vm[0]
-            else:
+        # VMs are kept in the order their first network was found
+        vms = OrderedDict()
+        for n in networks:
+            uuid = n.pop(foreign_key)
+            if uuid not in parents:
                 continue
 
-            # Translates the DB fields to DAO fields
-            n = TopologyVM.translate_db_to_dao(n, VMNetworkDAO.DB_MAP)
+            # Create the VM if don't exist
+            if uuid not in vms:
+                vm = parents.get(uuid)[0]
+                if append_network:
+                    vm['network'] = []
+                vms[uuid] = vm
+
+            if append_network:
+                vms[uuid]['network'].append(n)
+
+        if page is None:
+            resp.body = self.format_body(list(vms.values()), from_dict=True)
+        else:
+            resp.body = self.format_page(req, 'vms', list(vms.values()), next_key)
 
-            # Search if the VM already existis
-            __vm__ = next((item for item in vms if item['uuid'] == n.get('uuid')), None)
 
-            # Create the VM if don't exist
-            if not __vm__:
+class TopologyVMStats(BaseResource):
+
+    ROUTES = [
+        '/topology/vm/stats',
+        '/topology/vm/stats/'
+    ]
+
+    @before(parse_multiple_parameters)
+    def on_get(self, req, resp):
+        """
+        Counts the VMs grouped by the group_by fields, e.g., ?group_by=location,hostname. The VMs can be searched with
+        the VM fields of search_by, as on /topology/vm.
+        :return:
+        200 OK - Object with the group_by fields and the count of each group
+        400 Bad Request - Unknown group_by field
+        """
+        group_by = []
+        # NOTE: Falcon may not split the comma separated values, depending on its options
+        for value in req.get_param_as_list('group_by') or []:
+            for field in value.split(','):
+                if field not in VirtualMachineDAO.DB_MAP:
+                    raise HTTPBadRequest(
+                        title='Invalid group_by',
+                        description='The group_by values must be any of {}'.format(
+                            ', '.join(VirtualMachineDAO.DB_MAP.keys())),
+                        code='005'
+                    )
+                if field not in group_by:
+                    group_by.append(field)
+
+        search_vm = {translate_search_key(k, VirtualMachineDAO.DB_MAP): v
+                     for k, v in req.query_context.get('search_by').items()
+                     if translate_search_key(k, VirtualMachineDAO.DB_MAP) is not None}
+
+        stats = Topology().count_by(
+            VirtualMachineDAO.TABLE,
+            *[VirtualMachineDAO.DB_MAP.get(field) for field in group_by],
+            labels=VirtualMachineDAO.__labels__(),
+            **search_vm
+        )
+        resp.body = self.format_body(OrderedDict([('group_by', group_by), ('stats', stats)]), from_dict=True)
+
+
+class TopologyVMBatch(BaseResource):
+
+    ROUTES = [
+        '/topology/vm/batch',
+        '/topology/vm/batch/'
+    ]
+
+    @validate(load_schema('vm_batch'))
+    def on_post(self, req, resp, parsed):
+        """
+        Collects a group of VMs with their networks at once.
+        The filter follows the /topology/vm filter, the networks are replied when no filter is provided or when it
+        contains the network or a network field.
+        :return:
+        200 OK - List with the VMs found, in the order of the provided uuids
+        """
+        vm_columns = []
+        network_columns = []
+        append_network = len(parsed.get('filter', [])) == 0
+
+        # Translates the filter criteria to DB fields
+        for filter_ in parsed.get('filter', []):
+            if filter_ in VirtualMachineDAO.DB_MAP.keys():
+                vm_columns.append(VirtualMachineDAO.DB_MAP.get(filter_))
+            elif filter_ in VMNetworkDAO.DB_MAP.keys():
+                network_columns.append(VMNetworkDAO.DB_MAP.get(filter_))
+                append_network = True
+            elif filter_ == 'network':
+                append_network = True
+
+        # Keep only the foreign key when only network fields are requested
+        foreign_key = VirtualMachineDAO.DB_MAP.get(VirtualMachineDAO.FOREIGN_KEY)
+        if len(parsed.get('filter', [])) > 0 and foreign_key not in vm_columns:
+            vm_columns.append(foreign_key)
+
+        vms = Topology().get_vms_by_uuid(
+            parsed.get('uuids'),
+            vm_columns=vm_columns,
+            network_columns=network_columns,
+            networks=append_network,
+            labelled=True
+        )
+
+        response = []
+        for vm in vms.values():
+            networks = vm.pop('network', None)
+            if networks is not None:
                 vm['network'] = []
-                __vm__ = vm
+                for n in networks:
+                    n.pop('uuid', None)
+                    vm['network'].append(n)
+            response.append(vm)
+        resp.body = self.format_body(response, from_dict=True)
 
-                # Translates the DB fields to DAO fields
-                vm = TopologyVM.translate_db_to_dao(vm, VirtualMachineDAO.DB_MAP)
-                vms.append(vm)
-                n.pop('uuid')
 
-            if 'network' in vm_columns \
-                    or len(network_columns) > 1 \
-                    or len(network_columns) == 1 and len(vm_columns) == 1:
-                __vm__['network'].append(n)
-            else:
-                __vm__.pop('network', None)
+class GraphNeighbours(BaseResource):
 
-        resp.body = self.format_body(vms, from_dict=True)
+    ROUTES = [
+        '/topology/graph/{node}/{key}',
+        '/topology/graph/{node}/{key}/'
+    ]
 
-    @staticmethod
-    def translate_db_to_dao(item, dictionary):
-        for key, value in dictionary.items():
-            if value in item.keys():
-                item[key] = item.pop(value)
-        return item
+    def on_get(self, req, resp, node, key):
+        """
+        Replies the nodes attached to a host, network or VM, from the worker topology graph.
+        :return:
+        200 OK - Object with the keys of the attached nodes
+        404 Not Found - Unknown node type or key
+        """
+        lookups = dict(host=TopologyGraph().host, network=TopologyGraph().network, vm=TopologyGraph().vm)
+        if node not in lookups:
+            raise HTTPNotFound()
+        neighbours = lookups.get(node)(key)
+        if neighbours is None:
+            raise HTTPNotFound()
+        resp.body = self.format_body(neighbours, from_dict=True)
 
 
 class Location(BaseResource):
@@ -222,4 +483,19 @@ class Location(BaseResource):
     ]
 
     def on_get(self, req, resp):
-        resp.body = self.format_body(dict(locations=Topology().get_all_locations()), from_dict=True)
+        if TopologyIndex().enabled:
+            locations = TopologyIndex().locations()
+        else:
+            locations = Topology().get_all_locations()
+        resp.body = self.format_body(dict(locations=locations), from_dict=True)
+
+
+class DatabasePool(BaseResource):
+
+    ROUTES = [
+        '/topology/database/pool',
+        '/topology/database/pool/'
+    ]
+
+    def on_get(self, req, resp):
+        resp.body = self.format_body(DBLoader().pool_statistics(), from_dict=True)
@@ -0,0 +1,93 @@
+import os
+import sqlite3
+import tempfile
+
+from pkg_resources import resource_filename as rf
+
+# SQLite stand-in of the topology DB, shared by all tests since the configuration is read only once per process
+TOPOLOGY_DB = os.path.join(tempfile.gettempdir(), 'nbi_topology.db')
+
+
+def create_topology_db(path, vms, interfaces):
+    """
+    Creates a SQLite stand-in of the topology DB with the tables named on the default conf.ini.
+    :param path: The path of the SQLite file to create
+    :param vms: The number of VMs to insert, each one on a physical machine out of 100
+    :param interfaces: The total number of VM networks, spread evenly over the VMs
+    """
+    if os.path.exists(path):
+        os.remove(path)
+
+    connection = sqlite3.connect(path)
+    connection.executescript('''
+        CREATE TABLE pm (hostname VARCHAR(64) PRIMARY KEY, location VARCHAR(64), ip VARCHAR(64),
+            networkId VARCHAR(64), state VARCHAR(16));
+        CREATE TABLE vm (uuid VARCHAR(64) PRIMARY KEY, location VARCHAR(64), name VARCHAR(64), tenantId VARCHAR(64),
+            userId VARCHAR(64), hostName VARCHAR(64), hostIp VARCHAR(64), instanceId VARCHAR(64), imageId VARCHAR(64),
+            reportedTime BIGINT, resourceId VARCHAR(64), state VARCHAR(16));
+        CREATE TABLE vmnetworks (id INTEGER PRIMARY KEY AUTOINCREMENT, uuid VARCHAR(64), mac VARCHAR(64),
+            iface VARCHAR(64), dhcp VARCHAR(64), gateway VARCHAR(64), dns VARCHAR(64), vmIp VARCHAR(64),
+            networkId VARCHAR(64), portId VARCHAR(64), ovsId VARCHAR(64), segmentationId VARCHAR(64),
+            reportedTime BIGINT, resourceId VARCHAR(64));
+        CREATE INDEX vmnetworks_uuid ON vmnetworks (uuid);
+        CREATE TABLE lte (IMSI VARCHAR(64) PRIMARY KEY, MCC VARCHAR(8), MNC VARCHAR(8), UEId VARCHAR(16),
+            mmeTeidS11 VARCHAR(16), sgwTeidS11 VARCHAR(16), epsBearerId VARCHAR(16), MMEIp VARCHAR(64),
+            sgwTeidS1 VARCHAR(16), enbTeidS1u VARCHAR(16), sgwIPS1U VARCHAR(64), enbIPS1U VARCHAR(64),
+            UEIP VARCHAR(64));
+    ''')
+
+    connection.executemany(
+        'INSERT INTO pm VALUES (?, ?, ?, ?, ?)',
+        [('host-{}'.format(h), 'location-{}'.format(h % 4), '10.0.{}.{}'.format(h // 250, h % 250), 'mgmt', 'CREATE')
+         for h in range(100)]
+    )
+    connection.executemany(
+        'INSERT INTO vm VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        [('vm-{:08d}'.format(v), 'location-{}'.format(v % 4), 'vm-{}'.format(v), 'tenant-{}'.format(v % 10), 'user',
+          'host-{}'.format(v % 100), '10.0.{}.{}'.format((v % 100) // 250, v % 100), 'instance-{}'.format(v),
+          'image-{}'.format(v % 5), v, 'resource-{}'.format(v), 'CREATE') for v in range(vms)]
+    )
+    connection.executemany(
+        'INSERT INTO vmnetworks (uuid, mac, iface, gateway, vmIp, networkId, portId, reportedTime)'
+        ' VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+        [('vm-{:08d}'.format(i % vms), 'fa:16:3e:{:06x}'.format(i), 'eth{}'.format(i // vms), '192.168.0.1',
+          '192.168.{}.{}'.format(i // 250 % 250, i % 250), 'network-{}'.format(i // vms), 'port-{}'.format(i), i)
+         for i in range(interfaces)]
+    )
+    connection.executemany(
+        'INSERT INTO lte (IMSI, MCC, MNC, UEId, MMEIp, sgwIPS1U, enbIPS1U, UEIP) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+        [('26801{:010d}'.format(u), '268', '01', str(u), '10.1.0.1', '10.1.0.2', '10.1.0.{}'.format(3 + u % 10),
+          '172.16.{}.{}'.format(u // 250, u % 250)) for u in range(1000)]
+    )
+    connection.commit()
+    connection.close()
+
+
+def configure(path):
+    """
+    Points the service configuration to the SQLite topology DB.
+    Must be called before importing any DAO, since the configuration is read on import. The pooled connections are
+    closed, so a DB created again on the same path is used.
+    :param path: The path of the SQLite file
+    :return: The path of the generated ini file
+    """
+    from service.conf_reader import ConfReader
+
+    with open(rf('service.conf_reader', 'etc/conf.ini')) as fp:
+        lines = fp.readlines()
+
+    fd, ini_file = tempfile.mkstemp(suffix='.ini')
+    with os.fdopen(fd, 'w') as fp:
+        section = None
+        for line in lines:
+            if line.startswith('['):
+                section = line.strip()
+            if section == '[TOPOLOGY_DATABASE]' and line.startswith('url'):
+                line = "url = 'sqlite:///{}'\n".format(path)
+            fp.write(line)
+
+    ConfReader(ini_file)
+
+    from service.model.db.db_parser import DBLoader
+    DBLoader().dispose()
+    return ini_file
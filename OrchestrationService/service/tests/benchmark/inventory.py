@@ -0,0 +1,104 @@
+"""
+Benchmark of the inventory service encoding.
+It compares jsonpickle, encoding the records as plain objects with the attributes the model set before the slots,
+against the to_dict serializers of the slotted model, and asserts both reply the same JSON.
+
+Usage: python -m service.tests.benchmark.inventory [--apps 50] [--vms 10]
+"""
+import argparse
+import time
+
+import jsonpickle
+
+
+# Attributes set by the __init__ of each inventory class before the slots, in the order they were set. They are kept
+# here instead of read from the model, so a field missing or moved on the to_dict serializers makes the bodies differ.
+BASELINE_ATTRIBUTES = dict(
+    Service=('id', 'created', 'status', 'type', 'info', 'lifecycle', 'related_services', 'network_services',
+             'sdn_apps'),
+    NetworkService=('id', 'status', 'type', 'nfvo', 'apps', 'sdn_apps'),
+    APP=('id', 'status', 'type', 'app_class', 'location', 'vm_ids', 'virtual_machines')
+)
+OPTIONAL_ATTRIBUTES = ('created', 'virtual_machines')  # Only set when provided, e.g., the VMs when expanded
+
+
+class PlainRecord(object):
+    """
+    Record with an instance dict, as the inventory model was before the slots.
+    """
+
+    def __init__(self, record):
+        for name in BASELINE_ATTRIBUTES.get(type(record).__name__):
+            if name in OPTIONAL_ATTRIBUTES and not hasattr(record, name):
+                continue
+            setattr(self, name, PlainRecord.__plain__(getattr(record, name)))
+
+    @staticmethod
+    def __plain__(value):
+        if type(value).__name__ in BASELINE_ATTRIBUTES:
+            return PlainRecord(value)
+        if isinstance(value, list):
+            return [PlainRecord.__plain__(item) for item in value]
+        return value
+
+
+def create_service(apps, vms):
+    """
+    Builds a service with half of the apps on a network service, each with the given number of VMs.
+    The VM rows are created in memory, so the DB is not needed.
+    """
+    from service.model.inventory import APP, NetworkService, Service
+
+    network_service = NetworkService('ACTIVE', 'vEPC', 'ns-0', 'nfvo-0')
+    sdn_apps = []
+    for app in range(apps):
+        uuids = ['uuid-{:05d}-{:02d}'.format(app, vm) for vm in range(vms)]
+        rows = {uuid: dict(state='CREATE', location='loc-{}'.format(app % 4), name='vm-{}'.format(uuid),
+                           hostname='host-{}'.format(app % 8), uuid=uuid, reported_time=1500000000 + app,
+                           network=[dict(uuid=uuid, mac='fa:16:3e:00:00:00', ip='10.0.{}.{}'.format(app % 250, vm))
+                                    for vm in range(2)])
+                for uuid in uuids}
+        record = APP('ACTIVE', 'app-type', 'app-{}'.format(app), 'VNF' if app % 2 else 'SDN', 'loc-{}'.format(app % 4),
+                     uuids, queried_vms=rows)
+        if app % 2:
+            network_service.append_app(record)
+        else:
+            sdn_apps.append(record)
+    return Service('ACTIVE', 'service-type', 'service-0', '2017-01-01T00:00:00', {'name': 'service-0'},
+                   {'status': 'DEPLOYED'}, [], [network_service], sdn_apps)
+
+
+def measure(function, data, rounds):
+    best, result = None, None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = function(data)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--apps', type=int, default=50)
+    parser.add_argument('--vms', type=int, default=10)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    from service.resources import BaseResource
+
+    service = create_service(args.apps, args.vms)
+    jsonpickle_time, jsonpickle_body = measure(lambda data: jsonpickle.encode(data, unpicklable=False),
+                                               PlainRecord(service), args.rounds)
+    to_dict_time, to_dict_body = measure(BaseResource().format_body, service, args.rounds)
+
+    assert jsonpickle_body == to_dict_body, 'Bodies differ'
+    print('Apps: {} VMs per app: {} Body: {} bytes (best of {})'.format(
+        args.apps, args.vms, len(to_dict_body), args.rounds))
+    print('jsonpickle: {:.3f}s'.format(jsonpickle_time))
+    print('to_dict:    {:.3f}s'.format(to_dict_time))
+    print('Speedup:    {:.1f}x'.format(jsonpickle_time / to_dict_time))
+
+
+if __name__ == '__main__':
+    main()
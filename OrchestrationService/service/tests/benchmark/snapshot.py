@@ -0,0 +1,74 @@
+"""
+Benchmark of the VM section of the topology snapshot.
+It compares the per VM network queries against the prefetch of all the networks in a single query.
+
+Usage: python -m service.tests.benchmark.snapshot [--vms 10000] [--interfaces 40000]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from service.tests import create_topology_db, configure
+
+
+def per_vm(session):
+    from service.model.db.dao.abstract import ABSDao
+    from service.model.db.dao.topology.virtual import VirtualMachineDAO, VMNetworkDAO
+
+    snapshot = ABSDao.snapshot(VirtualMachineDAO(session))
+    for entry in snapshot:
+        vm = entry.get(VirtualMachineDAO.INNER_OBJ)
+        vm['network'] = VMNetworkDAO(session, vm.get(VirtualMachineDAO.FOREIGN_KEY)).snapshot()
+    return snapshot
+
+
+def prefetch(session):
+    from service.model.db.dao.topology.virtual import VirtualMachineDAO
+
+    return VirtualMachineDAO(session).snapshot()
+
+
+def measure(function, rounds):
+    from service.model.db.db_parser import DBLoader
+
+    best, result = None, None
+    for _ in range(rounds):
+        session = DBLoader().create_session()
+        try:
+            start = time.perf_counter()
+            result = function(session)
+            elapsed = time.perf_counter() - start
+        finally:
+            session.close()
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--vms', type=int, default=10000)
+    parser.add_argument('--interfaces', type=int, default=40000)
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.gettempdir(), 'nbi_topology_benchmark.db')
+    create_topology_db(path, args.vms, args.interfaces)
+    ini_file = configure(path)
+
+    try:
+        per_vm_time, per_vm_snapshot = measure(per_vm, args.rounds)
+        prefetch_time, prefetch_snapshot = measure(prefetch, args.rounds)
+    finally:
+        os.remove(ini_file)
+        os.remove(path)
+
+    assert per_vm_snapshot == prefetch_snapshot, 'Snapshots differ'
+    print('VMs: {} Interfaces: {} (best of {})'.format(args.vms, args.interfaces, args.rounds))
+    print('Per VM queries: {:.3f}s'.format(per_vm_time))
+    print('Prefetch:       {:.3f}s'.format(prefetch_time))
+    print('Speedup:        {:.1f}x'.format(per_vm_time / prefetch_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+import os
+import queue
+import sqlite3
+import time
+import unittest
+
+from service.tests import TOPOLOGY_DB, create_topology_db, configure
+
+
+class TestTopologyEvents(unittest.TestCase):
+    """
+    Validates the topology change detection against a SQLite stand-in of the topology DB.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.path = TOPOLOGY_DB
+        create_topology_db(cls.path, 10, 20)
+        cls.ini_file = configure(cls.path)
+
+        from service.model.events import EventBroker
+        cls.broker = EventBroker()
+        cls.broker.interval = 0.1
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.broker.stop()
+        os.remove(cls.ini_file)
+        os.remove(cls.path)
+
+    def setUp(self):
+        self.subscriber = self.broker.subscribe()
+        self.connection = sqlite3.connect(self.path)
+
+        # Wait for the first poll, which only collects the token to compare with
+        deadline = time.monotonic() + 5
+        while self.broker.token is None and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+    def tearDown(self):
+        self.broker.unsubscribe(self.subscriber)
+        self.connection.close()
+
+    def wait_messages(self):
+        """
+        Wait for the next event published to the subscriber
+        :return: List with the event messages
+        """
+        try:
+            token, messages = self.subscriber.queue.get(timeout=5)
+        except queue.Empty:
+            self.fail('No topology event was published')
+        return messages
+
+    def test_created_vm_event(self):
+        """
+        Test that validates a new VM is published to the subscribers.
+        It asserts the event type, message type and the VM uuid.
+        :return:
+        """
+        subscriber = self.broker.subscribe()  # A second subscriber must not change the events
+        try:
+            self.connection.execute("INSERT INTO vm (uuid, name, reportedTime, state) "
+                                    "VALUES ('vm-new', 'new', 100, 'CREATE')")
+            self.connection.commit()
+
+            messages = self.wait_messages()
+        finally:
+            self.broker.unsubscribe(subscriber)
+        self.assertEqual(len(messages), 1)
+        self.assertEqual(messages[0].get('eventtype'), 'instance_event')
+        self.assertEqual(messages[0].get('type'), 'CREATE')
+        self.assertEqual(messages[0].get('vm').get('uuid'), 'vm-new')
+
+    def test_removed_host_event(self):
+        """
+        Test that validates a removed physical machine is published as a tombstone.
+        It asserts the event type, message type and the hostname.
+        :return:
+        """
+        self.connection.execute("DELETE FROM pm WHERE hostname = 'host-1'")
+        self.connection.commit()
+
+        messages = self.wait_messages()
+        self.assertEqual(len(messages), 1)
+        self.assertEqual(messages[0].get('eventtype'), 'compute_event')
+        self.assertEqual(messages[0].get('type'), 'DELETE')
+        self.assertEqual(messages[0].get('compute_node'), {'hostname': 'host-1'})
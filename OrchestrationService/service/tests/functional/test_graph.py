@@ -0,0 +1,117 @@
+import os
+import sqlite3
+import unittest
+
+from service.tests import TOPOLOGY_DB, create_topology_db, configure
+
+
+class TestTopologyGraph(unittest.TestCase):
+    """
+    Validates the topology graph against a SQLite stand-in of the topology DB.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.path = TOPOLOGY_DB
+        create_topology_db(cls.path, 10, 20)
+        cls.ini_file = configure(cls.path)
+
+        from service.model.graph import TopologyGraph
+        cls.graph = TopologyGraph()
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove(cls.ini_file)
+        os.remove(cls.path)
+
+    def setUp(self):
+        self.connection = sqlite3.connect(self.path)
+
+    def tearDown(self):
+        self.connection.close()
+
+    def test_neighbours_match_db(self):
+        """
+        Test that validates the VMs and networks of a host, and the hosts of a network, match the DB.
+        :return:
+        """
+        hostname = self.connection.execute('SELECT hostName FROM vm ORDER BY uuid').fetchone()[0]
+        uuids = [row[0] for row in self.connection.execute('SELECT uuid FROM vm WHERE hostName = ?', (hostname,))]
+        networks = [row[0] for row in self.connection.execute(
+            'SELECT DISTINCT networkId FROM vmnetworks WHERE uuid IN (SELECT uuid FROM vm WHERE hostName = ?)',
+            (hostname,))]
+
+        host = self.graph.host(hostname)
+        self.assertEqual(sorted(host.get('vms')), sorted(uuids))
+        self.assertEqual(sorted(host.get('networks')), sorted(networks))
+        self.assertTrue(hostname in self.graph.network(networks[0]).get('hosts'))
+        self.assertEqual(self.graph.vm(uuids[0]).get('hostname'), hostname)
+        self.assertIsNone(self.graph.host('unknown'))
+
+    def test_ues_attached_on_change(self):
+        """
+        Test that validates a UE is attached to the VM with its eNB IP once the VM network is added.
+        :return:
+        """
+        uuid, hostname = self.connection.execute('SELECT uuid, hostName FROM vm ORDER BY uuid').fetchone()
+        enb_ip = self.connection.execute('SELECT enbIPS1U FROM lte').fetchone()[0]
+        imsis = [row[0] for row in self.connection.execute('SELECT IMSI FROM lte WHERE enbIPS1U = ?', (enb_ip,))]
+        self.assertEqual(self.graph.vm(uuid).get('ues'), [])
+
+        self.connection.execute("INSERT INTO vmnetworks (uuid, vmIp, networkId, reportedTime) VALUES (?, ?, 's1u', 0)",
+                                (uuid, enb_ip))
+        self.connection.commit()
+        self.graph.WATERMARK.invalidate()
+
+        self.assertEqual(sorted(self.graph.vm(uuid).get('ues')), sorted(imsis))
+        self.assertEqual(sorted(self.graph.host(hostname).get('ues')), sorted(imsis))
+        self.assertEqual(self.graph.network('s1u').get('vms'), [uuid])
+
+    def test_watermark_revalidation_window(self):
+        """
+        Test that validates the lookups don't query the DB watermark while it's fresh, and see the changes once it's
+        checked again.
+        :return:
+        """
+        from unittest import mock
+
+        from service.model.topology import Topology
+
+        hostname = self.connection.execute('SELECT hostName FROM vm ORDER BY uuid').fetchone()[0]
+        self.graph.host(hostname)
+        with mock.patch.object(Topology, 'get_watermark', side_effect=AssertionError('Watermark queried')):
+            self.assertIsNotNone(self.graph.host(hostname))
+
+        self.connection.execute("INSERT INTO pm (hostname, location, ip, networkId, state) "
+                                "VALUES ('host-new', 'location-0', '10.1.0.1', 'mgmt', 'CREATE')")
+        self.connection.commit()
+        self.assertIsNone(self.graph.host('host-new'))
+        self.graph.WATERMARK.invalidate()
+        self.assertIsNotNone(self.graph.host('host-new'))
+
+    def test_ue_handover_after_ttl(self):
+        """
+        Test that validates a UE moved in place to another eNB, which doesn't move the watermark, is attached to the VM
+        with its new eNB IP once the UEs are older than the snapshot cache ttl.
+        :return:
+        """
+        from unittest import mock
+
+        from service.model.topology import Topology
+
+        uuid = self.connection.execute('SELECT uuid FROM vm ORDER BY uuid DESC').fetchone()[0]
+        imsi = self.connection.execute('SELECT IMSI FROM lte ORDER BY IMSI DESC').fetchone()[0]
+        self.connection.execute("INSERT INTO vmnetworks (uuid, vmIp, networkId, reportedTime) "
+                                "VALUES (?, '10.9.9.9', 's1u-handover', 0)", (uuid,))
+        self.connection.commit()
+        self.graph.WATERMARK.invalidate()
+        self.assertEqual(self.graph.vm(uuid).get('ues'), [])
+
+        self.connection.execute("UPDATE lte SET enbIPS1U = '10.9.9.9' WHERE IMSI = ?", (imsi,))
+        self.connection.commit()
+        self.graph.WATERMARK.invalidate()
+        self.assertEqual(self.graph.vm(uuid).get('ues'), [])
+
+        with mock.patch.object(Topology.SNAPSHOT_CACHE, 'ttl', 0):
+            self.graph.WATERMARK.invalidate()
+            self.assertEqual(self.graph.vm(uuid).get('ues'), [imsi])
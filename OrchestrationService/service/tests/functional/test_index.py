@@ -0,0 +1,69 @@
+import os
+import sqlite3
+import unittest
+
+from service.tests import TOPOLOGY_DB, create_topology_db, configure
+
+
+class TestTopologyIndex(unittest.TestCase):
+    """
+    Validates the topology indexes against a SQLite stand-in of the topology DB.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.path = TOPOLOGY_DB
+        create_topology_db(cls.path, 10, 20)
+        cls.ini_file = configure(cls.path)
+
+        from service.model.index import TopologyIndex
+        cls.index = TopologyIndex()
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove(cls.ini_file)
+        os.remove(cls.path)
+
+    def setUp(self):
+        self.connection = sqlite3.connect(self.path)
+
+    def tearDown(self):
+        self.connection.close()
+
+    def test_lookups_match_db(self):
+        """
+        Test that validates the index lookups reply the same as the DB.
+        It asserts the locations, eNBs, UEs by IP and VMs by hostname.
+        :return:
+        """
+        self.index.refresh()
+        locations = [row[0] for row in self.connection.execute('SELECT DISTINCT location FROM vm')]
+        self.assertEqual(sorted(self.index.locations()), sorted(locations))
+
+        enbs = [row[0] for row in self.connection.execute('SELECT DISTINCT enbIPS1U FROM lte')]
+        self.assertEqual(sorted(self.index.enbs()), sorted(enbs))
+
+        ip, count = self.connection.execute('SELECT UEIP, count(*) FROM lte GROUP BY UEIP').fetchone()
+        self.assertEqual(len(self.index.ues_by_ip(ip)), count)
+
+        hostname, count = self.connection.execute('SELECT hostName, count(*) FROM vm GROUP BY hostName').fetchone()
+        vms = self.index.vms_by_hostname(hostname, 'uuid')
+        self.assertEqual(len(vms), count)
+        self.assertEqual([list(vm.keys()) for vm in vms], [['uuid']] * count)
+
+    def test_refresh_changed_vms(self):
+        """
+        Test that validates a refresh reads the changed VMs and forgets the removed ones.
+        It asserts the new location and the VMs of the host.
+        :return:
+        """
+        self.index.refresh()
+        hostname, uuid = self.connection.execute('SELECT hostName, uuid FROM vm ORDER BY uuid').fetchone()
+        self.connection.execute("UPDATE vm SET location = 'moved', reportedTime = reportedTime + 1 WHERE uuid = ?",
+                                (uuid,))
+        self.connection.execute("DELETE FROM vm WHERE hostName = ? AND uuid != ?", (hostname, uuid))
+        self.connection.commit()
+
+        self.index.refresh()
+        self.assertTrue('moved' in self.index.locations())
+        self.assertEqual([vm.get('uuid') for vm in self.index.vms_by_hostname(hostname)], [uuid])
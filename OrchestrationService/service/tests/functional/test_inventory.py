@@ -39,3 +39,24 @@ class TestInveontory(InventoryTestCase):
         """
         result = self.app.get(TestInveontory.ROUTE + '/FW-001', headers={'X-Auth-Token': self.cloud_admin})
         self.assertTrue(result.status, 200)
+
+    def test_collect_service_without_vms(self):
+        """
+        Test that validates the VMs of a service are only replied in detail when expanded
+        It asserts the response code 200 and that the apps only have the VM ids
+        :return:
+        """
+        result = self.app.get(TestInveontory.ROUTE + '/FW-001', headers={'X-Auth-Token': self.cloud_admin})
+        self.assertTrue(result.status, 200)
+        data = json.loads(result.body.decode('utf-8'))
+        for app in data.get('sdn_apps'):
+            self.assertFalse('virtual_machines' in app.keys())
+
+    def test_collect_service_invalid_expand(self):
+        """
+        Test that validates an unknown expand value is rejected
+        It asserts the response code 400
+        :return:
+        """
+        self.app.get(TestInveontory.ROUTE + '/FW-001?expand=unknown', headers={'X-Auth-Token': self.cloud_admin},
+                     status=400)
@@ -0,0 +1,155 @@
+import json
+import os
+import tempfile
+import unittest
+
+from service.tests import TOPOLOGY_DB, create_topology_db, configure
+
+
+class TestReplicaRouter(unittest.TestCase):
+    """
+    Validates the routing of the read-only sessions among SQLite stand-ins of the topology DB replicas.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.path = TOPOLOGY_DB
+        create_topology_db(cls.path, 10, 20)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove(cls.path)
+
+    def setUp(self):
+        from service.model.db.db_parser import DBLoader, Replica
+
+        missing = os.path.join(tempfile.gettempdir(), 'nbi_missing_dir', 'topology.db')
+        self.healthy = [Replica(DBLoader.__create_engine__('sqlite:///{}'.format(self.path), dict()), 30)
+                        for _ in range(2)]
+        self.unhealthy = Replica(DBLoader.__create_engine__('sqlite:///{}'.format(missing), dict()), 30)
+
+    def tearDown(self):
+        for replica in self.healthy + [self.unhealthy]:
+            replica.engine.dispose()
+
+    def test_round_robin_skips_unhealthy(self):
+        """
+        Test that validates the round robin routing takes turns among the healthy replicas only.
+        :return:
+        """
+        from service.model.db.db_parser import ReplicaRouter
+
+        router = ReplicaRouter([self.healthy[0], self.unhealthy, self.healthy[1]], ReplicaRouter.ROUND_ROBIN)
+        chosen = [router.choose() for _ in range(4)]
+        self.assertEqual(chosen, self.healthy * 2)
+        self.assertFalse(self.unhealthy.healthy)
+
+    def test_least_loaded(self):
+        """
+        Test that validates the least loaded routing chooses the replica with less connections checked out.
+        :return:
+        """
+        from service.model.db.db_parser import ReplicaRouter
+
+        router = ReplicaRouter(self.healthy, ReplicaRouter.LEAST_LOADED)
+        connection = self.healthy[0].engine.connect()
+        try:
+            self.assertIs(router.choose(), self.healthy[1])
+        finally:
+            connection.close()
+
+    def test_fallback_to_primary(self):
+        """
+        Test that validates there's no replica to read from when none is healthy, and a failed replica is skipped
+        until its next health check.
+        :return:
+        """
+        from service.model.db.db_parser import ReplicaRouter
+
+        self.assertIsNone(ReplicaRouter([self.unhealthy]).choose())
+
+        router = ReplicaRouter([self.healthy[0]])
+        self.healthy[0].failed()
+        self.assertIsNone(router.choose())
+        self.healthy[0].checked -= self.healthy[0].check_interval
+        self.assertIs(router.choose(), self.healthy[0])
+
+
+class TestPinnedReplica(unittest.TestCase):
+    """
+    Validates the reads of an operation are pinned to one replica, with SQLite stand-ins of replicas lagging
+    differently.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.path = TOPOLOGY_DB
+        cls.lagging_path = os.path.join(tempfile.gettempdir(), 'nbi_topology_lagging.db')
+        create_topology_db(cls.path, 10, 20)
+        create_topology_db(cls.lagging_path, 8, 20)
+        cls.ini_file = configure(cls.path)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove(cls.ini_file)
+        os.remove(cls.path)
+        os.remove(cls.lagging_path)
+
+    def setUp(self):
+        from service.model.db.db_parser import DBLoader, Replica, ReplicaRouter
+
+        self.replicas = [Replica(DBLoader.__create_engine__('sqlite:///{}'.format(path), dict()), 30)
+                         for path in [self.path, self.lagging_path]]
+        self.router = ReplicaRouter(self.replicas, ReplicaRouter.ROUND_ROBIN)
+
+    def tearDown(self):
+        for replica in self.replicas:
+            replica.engine.dispose()
+
+    def test_section_matches_watermark(self):
+        """
+        Test that validates every section is read from the replica its watermark was read from, so each cached
+        section matches the watermark it's validated with.
+        :return:
+        """
+        from unittest import mock
+
+        from service.model.db.db_parser import DBLoader
+        from service.model.topology import Topology
+
+        index = list(Topology.LOADER.keys()).index('virtual')
+        vms = {Topology.get_watermark(replica.engine)[index]: count for replica, count in zip(self.replicas, [10, 8])}
+        self.assertEqual(len(vms), 2)
+
+        with mock.patch.object(DBLoader(), 'replicas', self.router):
+            for _ in range(4):
+                Topology.SNAPSHOT_CACHE.invalidate()
+                section = json.loads(Topology.get_serialized_topology(sections=['virtual']).decode('utf-8'))
+                watermark = Topology.SNAPSHOT_CACHE.get_entry('virtual').validator
+                self.assertEqual(len(section.get('virtual')), vms.get(watermark))
+        Topology.SNAPSHOT_CACHE.invalidate()
+
+    def test_changes_token_pinned(self):
+        """
+        Test that validates the polls of a changes token are read from the replica its state was read from, or from
+        the primary when that replica is unhealthy, so the VMs missing on a lagging replica are not replied as removed.
+        :return:
+        """
+        from unittest import mock
+
+        from service.model.db.db_parser import DBLoader
+        from service.model.topology import Topology
+
+        Topology.SNAPSHOT_CACHE.invalidate()
+        with mock.patch.object(DBLoader(), 'replicas', self.router):
+            changes = Topology.get_changes()
+            self.assertEqual(len(changes.get('virtual')), 10)
+            for _ in range(2):
+                changes = Topology.get_changes(changes.get('token'))
+                self.assertFalse(changes.get('reset'))
+                self.assertEqual(changes.get('virtual'), [])
+
+            self.replicas[0].failed()
+            changes = Topology.get_changes(changes.get('token'))
+            self.assertEqual(changes.get('virtual'), [])
+        Topology.SNAPSHOT_CACHE.invalidate()
@@ -0,0 +1,211 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from multiprocessing import get_context
+from unittest import mock
+
+from service.cache import SharedFileCache
+from service.tests import TOPOLOGY_DB, create_topology_db, configure
+
+# Worker polling the topology changes on its own process, with the arguments ini file, history directory, snapshot
+# cache ttl and, optionally, the since token
+CHANGES_WORKER = '''
+import json
+import sys
+from unittest import mock
+
+from service.conf_reader import ConfReader
+ConfReader(sys.argv[1])
+
+from service.cache import SharedFileCache
+from service.model.topology import Topology
+
+Topology.SNAPSHOT_CACHE.ttl = int(sys.argv[3])
+with mock.patch.object(Topology, 'CHANGES_HISTORY', SharedFileCache(sys.argv[2], 60)):
+    print(json.dumps(Topology.get_changes(sys.argv[4] if len(sys.argv) > 4 else None)))
+'''
+
+
+def refresh(directory):
+    """
+    Refreshes the entry as a worker would, building it only if no other worker did meanwhile.
+    :return: Whether this worker built the entry
+    """
+    cache = SharedFileCache(directory, 60)
+    with cache.lock('snapshot'):
+        entry = cache.open('snapshot', validator='w1')
+        if entry is not None:
+            entry[0].close()
+            return False
+        cache.set('snapshot', b'{"physical": []}', validator='w1')
+        return True
+
+
+class TestSharedFileCache(unittest.TestCase):
+    """
+    Validates the snapshot cache shared by the workers of a host.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = SharedFileCache(self.directory, 60)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_open_validated_entry(self):
+        """
+        Test that validates an entry is opened at its value only with the validator it was stored with, and each write
+        moves its generation.
+        :return:
+        """
+        self.assertIsNone(self.cache.open('snapshot'))
+        self.assertEqual(self.cache.set('snapshot', b'{"ue": []}', validator='w1'), 1)
+
+        entry, length = self.cache.open('snapshot', validator='w1')
+        with entry:
+            self.assertEqual(entry.read(), b'{"ue": []}')
+        self.assertEqual(length, len(b'{"ue": []}'))
+        self.assertIsNone(self.cache.open('snapshot', validator='w2'))
+
+        self.assertEqual(self.cache.set('snapshot', b'{"ue": [{}]}', validator='w2'), 2)
+        entry, length = self.cache.open('snapshot', validator='w2')
+        entry.close()
+        self.assertEqual(self.cache.generation('snapshot'), 2)
+        self.assertEqual(os.listdir(self.directory), ['snapshot'])  # Only the entry, the temporary file was replaced
+
+        self.assertIsNone(SharedFileCache(self.directory, 0).open('snapshot'))
+        self.assertFalse(SharedFileCache(None, 60).enabled)
+
+    def test_keys_inside_directory(self):
+        """
+        Test that validates the keys can't name files outside the cache directory, which is only accessible by its
+        owner.
+        :return:
+        """
+        cache = SharedFileCache(os.path.join(self.directory, 'changes'), 60)
+        self.assertEqual(os.stat(cache.directory).st_mode & 0o777, 0o700)
+        for key in ['/etc/passwd', '..', '../changes', '/']:
+            with self.assertRaises(ValueError):
+                cache.get(key)
+
+    def test_single_refresh_among_workers(self):
+        """
+        Test that validates only one of several workers refreshing a stale entry at the same time builds it.
+        :return:
+        """
+        with get_context('fork').Pool(4) as pool:
+            built = pool.map(refresh, [self.directory] * 8)
+        self.assertEqual(sum(built), 1)
+        self.assertEqual(self.cache.generation('snapshot'), 1)
+
+    def test_evict_oldest_entries(self):
+        """
+        Test that validates only the max_size most recently written entries are kept.
+        :return:
+        """
+        for index, key in enumerate(['t1', 't2', 't3']):
+            self.cache.set(key, b'{}')
+            os.utime(os.path.join(self.directory, key), (time.time() - 10 + index,) * 2)
+        self.cache.evict(2)
+        self.assertIsNone(self.cache.get('t1'))
+        self.assertEqual(self.cache.get('t3'), b'{}')
+        entries = [name for name in os.listdir(self.directory) if not name.endswith('.lock')]
+        self.assertEqual(sorted(entries), ['t2', 't3'])
+
+
+class TestSharedSnapshot(unittest.TestCase):
+    """
+    Validates the topology snapshot shared by the workers against a SQLite stand-in of the topology DB.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.path = TOPOLOGY_DB
+        create_topology_db(cls.path, 10, 20)
+        cls.ini_file = configure(cls.path)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove(cls.ini_file)
+        os.remove(cls.path)
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_refresh_skips_worker_cache(self):
+        """
+        Test that validates a shared refresh replies the same JSON as the worker snapshot, without keeping the
+        snapshot or its sections on the worker snapshot cache.
+        :return:
+        """
+        from service.model.topology import Topology
+
+        Topology.SNAPSHOT_CACHE.invalidate()
+        with mock.patch.object(Topology, 'SHARED_SNAPSHOT', SharedFileCache(self.directory, 60)):
+            entry, length = Topology.open_serialized_topology()
+            with entry:
+                shared = entry.read()
+
+            for key in ['snapshot'] + list(Topology.LOADER.keys()):
+                self.assertIsNone(Topology.SNAPSHOT_CACHE.get_entry(key))
+            self.assertEqual(length, len(shared))
+            self.assertEqual(shared, Topology.get_serialized_topology())
+
+    def test_changes_token_among_workers(self):
+        """
+        Test that validates a changes token issued by a worker is accepted by another worker of the host.
+        :return:
+        """
+        from service.model.topology import Topology
+
+        with mock.patch.object(Topology, 'CHANGES_HISTORY', SharedFileCache(self.directory, 60)):
+            changes = Topology.get_changes(None)
+            self.assertTrue(changes['reset'])
+
+        # Another worker only shares the directory of the history
+        with mock.patch.object(Topology, 'CHANGES_HISTORY', SharedFileCache(self.directory, 60)):
+            changes = Topology.get_changes(changes['token'])
+            self.assertFalse(changes['reset'])
+            self.assertTrue(Topology.get_changes('unknown')['reset'])
+
+    def test_changes_token_across_seeds(self):
+        """
+        Test that validates a changes token issued by a worker with another hash seed is accepted, and the sections
+        read again are only replied when they changed.
+        :return:
+        """
+        def poll(seed, *args):
+            env = dict(os.environ, PYTHONHASHSEED=str(seed))
+            output = subprocess.check_output([sys.executable, '-c', CHANGES_WORKER, self.ini_file, self.directory] +
+                                             list(args), env=env, cwd=os.getcwd())
+            return json.loads(output.decode('utf-8').splitlines()[-1])
+
+        issued = poll(1, '60')
+        self.assertTrue(issued['reset'])
+
+        # The snapshot ttl of 0 reads again the sections without a reported time
+        changes = poll(2, '0', issued['token'])
+        self.assertFalse(changes['reset'])
+        self.assertEqual(changes['token'], issued['token'])
+        for key in ['physical', 'virtual', 'ue']:
+            self.assertEqual(changes[key], [])
+
+    def test_malformed_changes_token(self):
+        """
+        Test that validates the tokens not created by the service are unknown, without reading any file.
+        :return:
+        """
+        from service.model.topology import Topology
+
+        with mock.patch.object(Topology, 'CHANGES_HISTORY', SharedFileCache(self.directory, 60)):
+            for token in ['/etc/passwd', '..', '/', 'a' * 39, 'A' * 40]:
+                self.assertTrue(Topology.get_changes(token)['reset'])
@@ -0,0 +1,78 @@
+import os
+import sqlite3
+import unittest
+
+from service.tests import TOPOLOGY_DB, create_topology_db, configure
+
+
+class TestTopologyStats(unittest.TestCase):
+    """
+    Validates the topology counts against a SQLite stand-in of the topology DB.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.path = TOPOLOGY_DB
+        create_topology_db(cls.path, 10, 20)
+        cls.ini_file = configure(cls.path)
+
+        from service.model.topology import Topology
+        cls.topology = Topology()
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove(cls.ini_file)
+        os.remove(cls.path)
+
+    def setUp(self):
+        self.connection = sqlite3.connect(self.path)
+
+    def tearDown(self):
+        self.connection.close()
+
+    def test_count_by_matches_db(self):
+        """
+        Test that validates the VM counts grouped by location and hostname match the DB, and add up to all VMs.
+        :return:
+        """
+        from service.model.db.dao.topology.virtual import VirtualMachineDAO
+
+        rows = self.connection.execute('SELECT location, hostName, COUNT(*) FROM vm GROUP BY location, hostName '
+                                       'ORDER BY location, hostName').fetchall()
+        total = self.connection.execute('SELECT COUNT(*) FROM vm').fetchone()[0]
+
+        stats = self.topology.count_by(VirtualMachineDAO.TABLE, 'location', 'hostName',
+                                       labels=VirtualMachineDAO.__labels__())
+        self.assertEqual([(stat.get('location'), stat.get('hostname'), stat.get('count')) for stat in stats], rows)
+        self.assertEqual(sum(stat.get('count') for stat in stats), total)
+        self.assertEqual(self.topology.count_by(VirtualMachineDAO.TABLE), [{'count': total}])
+
+        location = rows[0][0]
+        stats = self.topology.count_by(VirtualMachineDAO.TABLE, 'hostName', location=location)
+        self.assertEqual(sum(stat.get('count') for stat in stats), sum(row[2] for row in rows if row[0] == location))
+
+    def test_search_operators(self):
+        """
+        Test that validates the search operators parsed from search_by match the DB.
+        :return:
+        """
+        from service.model.db.dao.topology.virtual import VirtualMachineDAO
+        from service.utils import __parse_search__, translate_search_key
+
+        times = sorted(row[0] for row in self.connection.execute('SELECT reportedTime FROM vm'))
+        hostnames = [row[0] for row in self.connection.execute('SELECT DISTINCT hostName FROM vm ORDER BY hostName')]
+
+        def count(search_by):
+            search = {translate_search_key(k, VirtualMachineDAO.DB_MAP): v
+                      for k, v in __parse_search__(search_by).items()}
+            return self.topology.count_by(VirtualMachineDAO.TABLE, **search)[0].get('count')
+
+        self.assertEqual(count('reported_time__gt:{}'.format(times[4])), len(times) - 5)
+        self.assertEqual(count('reported_time__gte:{},reported_time__lt:{}'.format(times[2], times[7])), 5)
+        self.assertEqual(count('hostname__in:{}|{}'.format(*hostnames[:2])), self.connection.execute(
+            'SELECT COUNT(*) FROM vm WHERE hostName IN (?, ?)', hostnames[:2]).fetchone()[0])
+        self.assertEqual(count('hostname__not_in:{}|{}'.format(*hostnames[:2])), self.connection.execute(
+            'SELECT COUNT(*) FROM vm WHERE hostName NOT IN (?, ?)', hostnames[:2]).fetchone()[0])
+        self.assertEqual(count('hostname__prefix:{}'.format(hostnames[0][:-1])), self.connection.execute(
+            'SELECT COUNT(*) FROM vm WHERE hostName LIKE ?', (hostnames[0][:-1] + '%',)).fetchone()[0])
+        self.assertEqual(count('hostname__prefix:%'), 0)
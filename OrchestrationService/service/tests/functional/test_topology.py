@@ -0,0 +1,190 @@
+import base64
+import json
+
+from service.tests.functional import InventoryTestCase
+
+
+class TestTopologyVM(InventoryTestCase):
+    ROUTE = '/nbi/orchestration/api/topology/vm'
+
+    def test_collect_vms_unauth(self):
+        """
+        Test that validates an unauthenticated user can't access the VM topology
+        It asserts response code 401
+        :return:
+        """
+        result = self.app.get(TestTopologyVM.ROUTE, headers={'X-Auth-Token': ""}, status=401)
+        self.assertTrue(result.status, 401)
+
+    def test_collect_vms_with_networks(self):
+        """
+        Test that validates the VM list with the networks of each VM.
+        It asserts the response code 200, that every VM has an uuid and that the networks don't repeat it.
+        :return:
+        """
+        result = self.app.get(TestTopologyVM.ROUTE, headers={'X-Auth-Token': self.cloud_admin})
+        self.assertTrue(result.status, 200)
+        data = json.loads(result.body.decode('utf-8'))
+        for vm in data:
+            self.assertTrue('uuid' in vm.keys())
+            for network in vm.get('network', []):
+                self.assertFalse('uuid' in network.keys())
+
+    def test_collect_vms_filtered_by_network(self):
+        """
+        Test that validates the VM list filtered by network fields.
+        It asserts the response code 200 and that every network only contains the requested fields.
+        :return:
+        """
+        result = self.app.get(TestTopologyVM.ROUTE + '?filter=ip,mac', headers={'X-Auth-Token': self.cloud_admin})
+        self.assertTrue(result.status, 200)
+        data = json.loads(result.body.decode('utf-8'))
+        for vm in data:
+            for network in vm.get('network', []):
+                list(map(lambda field: self.assertTrue(field in ['ip', 'mac']), network.keys()))
+
+    def test_collect_vms_paginated(self):
+        """
+        Test that validates the VM pages, following the next links until the last page.
+        It asserts the response code 200, the page size limit and that the pages hold all VMs without repeating them.
+        :return:
+        """
+        result = self.app.get(TestTopologyVM.ROUTE, headers={'X-Auth-Token': self.cloud_admin})
+        vms = json.loads(result.body.decode('utf-8'))
+
+        uuids = []
+        route = TestTopologyVM.ROUTE + '?limit=2'
+        while route:
+            result = self.app.get(route, headers={'X-Auth-Token': self.cloud_admin})
+            self.assertTrue(result.status, 200)
+            data = json.loads(result.body.decode('utf-8'))
+            self.assertTrue(len(data.get('vms')) <= 2)
+            uuids.extend(vm.get('uuid') for vm in data.get('vms'))
+            links = [link.get('href') for link in data.get('links') if link.get('rel') == 'next']
+            route = links[0] if len(links) > 0 else None
+
+        self.assertEqual(sorted(uuids), sorted(vm.get('uuid') for vm in vms))
+
+    def test_collect_vms_invalid_cursor(self):
+        """
+        Test that validates an invalid cursor is rejected, including the valid JSON that is not a row key.
+        It asserts the response code 400
+        :return:
+        """
+        self.app.get(TestTopologyVM.ROUTE + '?cursor=invalid', headers={'X-Auth-Token': self.cloud_admin}, status=400)
+        for key in [b'{"a": 1}', b'[]', b'[[1]]', b'[{"a": 1}]', b'[null]', b'"vm"']:
+            cursor = base64.urlsafe_b64encode(key).decode('ascii').rstrip('=')
+            self.app.get(TestTopologyVM.ROUTE + '?cursor=' + cursor, headers={'X-Auth-Token': self.cloud_admin},
+                         status=400)
+
+
+class TestTopologyVMBatch(InventoryTestCase):
+    ROUTE = '/nbi/orchestration/api/topology/vm/batch'
+
+    def test_collect_vm_batch(self):
+        """
+        Test that validates a group of VMs is replied in the order of the uuids, ignoring the unknown ones.
+        It asserts the response code 200 and the uuids of the VMs
+        :return:
+        """
+        result = self.app.get(TestTopologyVM.ROUTE + '?filter=uuid', headers={'X-Auth-Token': self.cloud_admin})
+        uuids = [vm.get('uuid') for vm in json.loads(result.body.decode('utf-8'))][:3]
+        uuids.reverse()
+
+        result = self.app.post(TestTopologyVMBatch.ROUTE, params=json.dumps(dict(uuids=uuids + ['unknown'])),
+                               headers={'X-Auth-Token': self.cloud_admin})
+        self.assertTrue(result.status, 200)
+        self.assertEqual([vm.get('uuid') for vm in json.loads(result.body.decode('utf-8'))], uuids)
+
+    def test_collect_vm_batch_without_uuids(self):
+        """
+        Test that validates the uuids are required.
+        It asserts the response code 400
+        :return:
+        """
+        self.app.post(TestTopologyVMBatch.ROUTE, params=json.dumps(dict(filter=['name'])),
+                      headers={'X-Auth-Token': self.cloud_admin}, status=400)
+
+    def test_collect_vm_batch_oversized(self):
+        """
+        Test that validates a batch is limited to the maximum page size.
+        It asserts the response code 400 for one uuid more than MAX_PAGE_LIMIT
+        :return:
+        """
+        from service.schema import load_schema
+        from service.utils import MAX_PAGE_LIMIT
+
+        self.assertEqual(load_schema('vm_batch').get('properties').get('uuids').get('maxItems'), MAX_PAGE_LIMIT)
+        uuids = ['uuid-{}'.format(idx) for idx in range(MAX_PAGE_LIMIT + 1)]
+        self.app.post(TestTopologyVMBatch.ROUTE, params=json.dumps(dict(uuids=uuids)),
+                      headers={'X-Auth-Token': self.cloud_admin}, status=400)
+
+
+class TestSnapshotChanges(InventoryTestCase):
+    ROUTE = '/nbi/orchestration/api/topology/snapshot/changes'
+
+    def test_collect_changes_without_token(self):
+        """
+        Test that validates the first changes request replies the whole topology.
+        It asserts the response code 200, the reset flag and the token.
+        :return:
+        """
+        result = self.app.get(TestSnapshotChanges.ROUTE, headers={'X-Auth-Token': self.cloud_admin})
+        self.assertTrue(result.status, 200)
+        data = json.loads(result.body.decode('utf-8'))
+        self.assertTrue(data.get('reset'))
+        list(map(lambda field: self.assertTrue(field in data.keys()), ['token', 'physical', 'virtual', 'ue']))
+
+    def test_collect_changes_with_token(self):
+        """
+        Test that validates a changes request with the previous token only replies the changes.
+        It asserts the response code 200 and that the topology was not reset.
+        :return:
+        """
+        result = self.app.get(TestSnapshotChanges.ROUTE, headers={'X-Auth-Token': self.cloud_admin})
+        token = json.loads(result.body.decode('utf-8')).get('token')
+
+        result = self.app.get(TestSnapshotChanges.ROUTE + '?since=' + token,
+                              headers={'X-Auth-Token': self.cloud_admin})
+        self.assertTrue(result.status, 200)
+        data = json.loads(result.body.decode('utf-8'))
+        self.assertFalse(data.get('reset'))
+
+
+class TestSnapshotSection(InventoryTestCase):
+    ROUTE = '/nbi/orchestration/api/topology/snapshot'
+
+    def test_collect_section(self):
+        """
+        Test that validates a snapshot section replies the same messages as the whole snapshot.
+        It asserts the response code 200 and that only the requested section is replied.
+        :return:
+        """
+        result = self.app.get(TestSnapshotSection.ROUTE, headers={'X-Auth-Token': self.cloud_admin})
+        snapshot = json.loads(result.body.decode('utf-8'))
+
+        result = self.app.get(TestSnapshotSection.ROUTE + '/virtual', headers={'X-Auth-Token': self.cloud_admin})
+        self.assertTrue(result.status, 200)
+        data = json.loads(result.body.decode('utf-8'))
+        self.assertEqual(list(data.keys()), ['virtual'])
+        self.assertEqual(data.get('virtual'), snapshot.get('virtual'))
+
+    def test_collect_unknown_section(self):
+        """
+        Test that validates an unknown snapshot section is not found.
+        It asserts the response code 404
+        :return:
+        """
+        self.app.get(TestSnapshotSection.ROUTE + '/unknown', headers={'X-Auth-Token': self.cloud_admin}, status=404)
+
+
+class TestTopologyEvents(InventoryTestCase):
+    ROUTE = '/nbi/orchestration/api/topology/events'
+
+    def test_collect_events_single_thread(self):
+        """
+        Test that validates the event stream is refused when the workers have a single thread, as configured by default.
+        It asserts the response code 501
+        :return:
+        """
+        self.app.get(TestTopologyEvents.ROUTE, headers={'X-Auth-Token': self.cloud_admin}, status=501)
@@ -1,5 +1,18 @@
+import base64
+import binascii
+import json
+from urllib.parse import parse_qsl, urlencode
+
+from falcon import HTTPBadRequest
 from falcon.uri import parse_query_string
 
+MAX_PAGE_LIMIT = 1000  # Maximum number of items replied on a single page
+
+SEARCH_SEPARATOR = '__'  # Separates the field from the operator on the search_by criteria, e.g. reported_time__gt
+SEARCH_NEGATION = 'not_'  # Prefix negating a search operator, e.g. hostname__not_in
+SEARCH_OPERATORS = ('eq', 'ne', 'in', 'like', 'prefix', 'gt', 'gte', 'lt', 'lte')
+SEARCH_LIST_SEPARATOR = '|'  # Separates the values of the in operator, e.g. location__in:loc-1|loc-2
+
 
 class Singleton(type):
     """
@@ -39,16 +52,67 @@ def __parse_search__(query):
     Parse the search by.
     First checks if a string is passed and converts = to : in order to later create a dictionary.
     If multiple parameters are provided a list is created otherwise the list will only contain one criteria.
+    Each criteria is field:value for equality, or field__operator:value with one of SEARCH_OPERATORS, optionally
+    negated with the SEARCH_NEGATION prefix. The values of the in operators are split into a tuple.
 
     NOTE: This must be done because falcon parse the query parameters differently depending on the encoding.
 
     :param query: The query parameter parsed by falcon.
-    :return: Dict with the search criteria
+    :return: Dict with the search criteria, the field suffixed with the operator as key unless it's eq
     """
     query = query.replace('=', ':').split(',') if isinstance(query, str) else [item.replace('=', ':') for item in query]
     if isinstance(query, str):
         query = [query]
-    return dict(item.split(":") for item in query)
+
+    search = dict()
+    for item in query:
+        if ':' not in item:
+            raise HTTPBadRequest(
+                title='Invalid search',
+                description='The search_by criteria must be field:value or field{}operator:value'.format(
+                    SEARCH_SEPARATOR),
+                code='006'
+            )
+        key, value = item.split(':', 1)
+        field, operator = split_search_key(key)
+        if operator is None:
+            search[field] = value
+            continue
+
+        if (operator[len(SEARCH_NEGATION):] if operator.startswith(SEARCH_NEGATION) else operator) \
+                not in SEARCH_OPERATORS:
+            raise HTTPBadRequest(
+                title='Invalid search',
+                description='Unknown operator {} on {}, the operators are {} and their {} negation'.format(
+                    operator, field, ', '.join(SEARCH_OPERATORS), SEARCH_NEGATION),
+                code='006'
+            )
+        if operator.endswith('in'):
+            value = tuple(value.split(SEARCH_LIST_SEPARATOR))
+        search[field if operator == 'eq' else key] = value
+    return search
+
+
+def split_search_key(key):
+    """
+    :param key: A search criteria key, e.g. reported_time__gt
+    :return: Tuple with the field and the operator, None when there's no operator
+    """
+    field, separator, operator = key.partition(SEARCH_SEPARATOR)
+    return field, operator if separator else None
+
+
+def translate_search_key(key, db_map):
+    """
+    Translates the field of a search criteria key to its DB column, keeping the operator.
+    :param key: A search criteria key, e.g. reported_time__gt
+    :param db_map: The DAO DB_MAP
+    :return: The key with the DB column, e.g. reportedTime__gt, or None when the field isn't on the DB_MAP
+    """
+    field, operator = split_search_key(key)
+    if field not in db_map:
+        return None
+    return db_map.get(field) if operator is None else SEARCH_SEPARATOR.join([db_map.get(field), operator])
 
 
 def __parse_filter__(query):
@@ -64,3 +128,77 @@ def __parse_filter__(query):
     if isinstance(query, str):
         query = [query]
     return query
+
+
+def parse_pagination(req, resp, resource, params):
+    """
+    Parse the limit and cursor query parameters, used to paginate the topology routes.
+    The pagination is only applied when one of them is provided, otherwise the routes reply all items.
+    :return: Dict with the limit and the decoded cursor key set as the request context page, or None
+    """
+    limit = req.get_param('limit')
+    cursor = req.get_param('cursor')
+    req.context['page'] = None
+    if limit is None and cursor is None:
+        return
+
+    try:
+        limit = MAX_PAGE_LIMIT if limit is None else int(limit)
+    except ValueError:
+        limit = 0
+    if limit < 1 or limit > MAX_PAGE_LIMIT:
+        raise HTTPBadRequest(
+            title='Invalid pagination',
+            description='The limit must be an integer between 1 and {}'.format(MAX_PAGE_LIMIT),
+            code='003'
+        )
+
+    req.context['page'] = dict(limit=limit, cursor=__decode_cursor__(cursor) if cursor is not None else None)
+
+
+def encode_cursor(key):
+    """
+    Creates an opaque cursor pointing after a row.
+    :param key: The key of the last row replied
+    :return: Cursor string, or None if there are no more rows
+    """
+    if key is None:
+        return None
+    return base64.urlsafe_b64encode(json.dumps([key]).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def __decode_cursor__(cursor):
+    """
+    :param cursor: Cursor created by encode_cursor
+    :return: The key of the last row replied
+    """
+    try:
+        cursor = cursor + '=' * (-len(cursor) % 4)  # Restore the padding removed from the URL
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except (ValueError, TypeError, binascii.Error):
+        key = None
+
+    # Only a list with the scalar key of a row, as created by encode_cursor, is bound to the queries
+    if not isinstance(key, list) or len(key) == 0 or not isinstance(key[0], (str, int)) or isinstance(key[0], bool):
+        raise HTTPBadRequest(
+            title='Invalid pagination',
+            description='The provided cursor is not valid',
+            code='003'
+        )
+    return key[0]
+
+
+def pagination_links(req, cursor):
+    """
+    Creates the links of a page, the next link keeps all the query parameters and replaces the cursor.
+    :param req: The request of the page
+    :param cursor: The cursor of the next page, None if this is the last page
+    :return: List with the self link and the next link if there are more pages
+    """
+    links = list()
+    links.append(dict(href=req.uri, rel='self'))
+    if cursor is not None:
+        query = [(k, v) for k, v in parse_qsl(req.query_string, keep_blank_values=True) if k != 'cursor']
+        query.append(('cursor', cursor))
+        links.append(dict(href=req.uri.split('?')[0] + '?' + urlencode(query, safe=':,'), rel='next'))
+    return links